@@ -14,7 +14,7 @@ if not _ASTROPY_SETUP_:
     import logging
     import ConfigParser
     import os
-    from astropy.config import get_config_dir
+    from astropy.config import get_config_dir, get_cache_dir
 
     confparse = ConfigParser.RawConfigParser({'verbose': 1})
     confs_found = confparse.read(['arcus.cfg',
@@ -35,6 +35,10 @@ if not _ASTROPY_SETUP_:
 
     conf = Conf()
     conf.caldb_inputdata = confparse.get('data', 'caldb_inputdata')
+    try:
+        conf.cache_dir = os.path.expanduser(confparse.get('data', 'cache_dir'))
+    except (ConfigParser.MissingSectionHeaderError, ConfigParser.NoOptionError):
+        conf.cache_dir = os.path.join(get_cache_dir(), 'arcus')
     try:
         conf.verbose = confparse.getint('verbosity', 'verbose')
     except (ConfigParser.MissingSectionHeaderError, ConfigParser.NoOptionError):
@@ -1,3 +1,19 @@
+'''ARCUS set up for ray-tracing with MARXS.
+
+Geometry constants (blaze angle, Rowland tori, offsets of the optical axes)
+are set when this module is imported. All optical elements and all
+configurations of ARCUS are built on first access only and then reused, so
+that the time needed for setup scales with what is actually used.
+They can be accessed as module attributes, e.g. ``arcus.arcus.arcus4``,
+or by name through `get`, e.g. ``get('arcus4')``.
+
+`configurations` lists the names of the complete instrument configurations,
+`available` the names of all elements that can be built.
+'''
+import sys
+import types
+from collections import OrderedDict
+
 import numpy as np
 import astropy.units as u
 from scipy.interpolate import interp1d
@@ -9,17 +25,79 @@ from marxs.optics import (GlobalEnergyFilter,
                           FlatDetector, CATGrating,
                           RadialMirrorScatter)
 from marxs import optics
-from marxs.design.rowland import (RowlandTorus,
-                                  design_tilted_torus,
-                                  RectangularGrid,
-                                  RowlandCircleArray)
+from marxs.design.rowland import RowlandTorus, design_tilted_torus
 import marxs.analysis
 
 from ralfgrating import (InterpolateRalfTable, RalfQualityFactor,
                          catsupportbars, catsupport)
-from spo import SPOChannelMirror, spogeometricthroughput, doublereflectivity
+from spo import (IndexedSPOChannelMirror, SPOChannelasAperture,
+                 spogeometricthroughput, doublereflectivity)
 from .load_csv import load_number, load_table
 from .utils import tagversion
+from .layout import IndexedRectangularGrid, IndexedRowlandCircleArray
+from .sampling import SampledRectangleAperture, SampledMultiAperture
+
+_builders = OrderedDict()
+_components = {}
+
+configurations = ['arcus', 'arcusm', 'arcus4', 'arcus_for_plot',
+                  'arcus_extra_det4', 'arcus_extra_det', 'arcus_extra_det_m',
+                  'arcus_joern', 'arcus_joernm']
+'''Names of complete ARCUS configurations.'''
+
+
+def register(name):
+    '''Register a function that builds an element of ARCUS.
+
+    The decorated function is called without arguments the first time the
+    element is requested with `get`. Builders for elements that are shared
+    between configurations (e.g. the detectors) should call `get` for their
+    sub-components, so that those are built only once.
+
+    Parameters
+    ----------
+    name : string
+        Name of the element. The element will also be available as an
+        attribute of this module with this name.
+    '''
+    def decorator(func):
+        _builders[name] = func
+        return func
+    return decorator
+
+
+def get(name):
+    '''Get an element or configuration of ARCUS by name.
+
+    Elements are built on first access and the same object is returned on
+    all later calls.
+
+    Parameters
+    ----------
+    name : string
+        Name of the element, e.g. ``'arcus4'`` or ``'det_16'``.
+
+    Returns
+    -------
+    element : object
+        Optical element or `marxs.simulator.Sequence`.
+    '''
+    if name not in _components:
+        if name not in _builders:
+            raise KeyError('{} is not a known ARCUS element. Known elements are: {}'.format(name, ', '.join(_builders)))
+        _components[name] = _builders[name]()
+    return _components[name]
+
+
+def available():
+    '''Names of all elements that can be built with `get`.'''
+    return list(_builders.keys())
+
+
+def built():
+    '''Names of all elements that have been built so far.'''
+    return [n for n in _builders if n in _components]
+
 
 jitter_sigma = load_number('other', 'pointingjitter',
                            'FWHM') / 2.3545
@@ -72,36 +150,122 @@ entrancepos = np.array([12000., 0., -z_offset_spectra])
 # aper = optics.CircleAperture(position=[12200, 0, 0], zoom=300,
 #                       phi=[-0.3 + np.pi / 2, .3 + np.pi / 2])\
 
-aper_rect1 = optics.RectangleAperture(position=[12200, 0, 550], zoom=[1, 180, 250])
-aper_rect2 = optics.RectangleAperture(position=[12200, 0, -550], zoom=[1, 180, 250])
 
-aper_rect1m = optics.RectangleAperture(pos4d=np.dot(shift_optical_axis_12, aper_rect1.pos4d))
-aper_rect2m = optics.RectangleAperture(pos4d=np.dot(shift_optical_axis_12, aper_rect2.pos4d))
+@register('aper_rect1')
+def _aper_rect1():
+    return SampledRectangleAperture(position=[12200, 0, 550], zoom=[1, 180, 250])
+
+
+@register('aper_rect2')
+def _aper_rect2():
+    return SampledRectangleAperture(position=[12200, 0, -550], zoom=[1, 180, 250])
+
+
+@register('aper_rect1m')
+def _aper_rect1m():
+    return SampledRectangleAperture(pos4d=np.dot(shift_optical_axis_12, get('aper_rect1').pos4d))
+
+
+@register('aper_rect2m')
+def _aper_rect2m():
+    return SampledRectangleAperture(pos4d=np.dot(shift_optical_axis_12, get('aper_rect2').pos4d))
+
+
+@register('aper')
+def _aper():
+    return SampledMultiAperture(elements=[get('aper_rect1'), get('aper_rect2')])
+
+
+@register('aperm')
+def _aperm():
+    return SampledMultiAperture(elements=[get('aper_rect1m'), get('aper_rect2m')])
+
+
+@register('aper4')
+def _aper4():
+    return SampledMultiAperture(elements=[get('aper_rect1'), get('aper_rect2'),
+                                          get('aper_rect1m'), get('aper_rect2m')])
+
+
+# Apertures that generate photons only on the SPOs, not on the frame of the
+# petals. They are placed in the plane of the SPOs, not above, so that
+# photons from off-axis sources are not shifted off the edge of an SPO.
+@register('aper_spo1')
+def _aper_spo1():
+    return SPOChannelasAperture(pos4d=get('lens1').pos4d)
+
+
+@register('aper_spo2')
+def _aper_spo2():
+    return SPOChannelasAperture(pos4d=get('lens2').pos4d)
+
+
+@register('aper_spo1m')
+def _aper_spo1m():
+    return SPOChannelasAperture(pos4d=get('lens1m').pos4d)
+
+
+@register('aper_spo2m')
+def _aper_spo2m():
+    return SPOChannelasAperture(pos4d=get('lens2m').pos4d)
+
+
+@register('aper_spo')
+def _aper_spo():
+    return SampledMultiAperture(elements=[get('aper_spo1'), get('aper_spo2')])
+
+
+@register('aperm_spo')
+def _aperm_spo():
+    return SampledMultiAperture(elements=[get('aper_spo1m'), get('aper_spo2m')])
+
+
+@register('aper4_spo')
+def _aper4_spo():
+    return SampledMultiAperture(elements=[get('aper_spo1'), get('aper_spo2'),
+                                          get('aper_spo1m'), get('aper_spo2m')])
 
-aper = optics.MultiAperture(elements=[aper_rect1, aper_rect2])
-aperm = optics.MultiAperture(elements=[aper_rect1m, aper_rect2m])
-aper4 = optics.MultiAperture(elements=[aper_rect1, aper_rect2,
-                                       aper_rect1m, aper_rect2m])
 
 # Make lens a little larger than aperture, otherwise an non on-axis ray
 # (from pointing jitter or an off-axis source) might miss the mirror.
-lens1 = SPOChannelMirror(position=entrancepos,
-                         id_num_offset=0)
-lens2 = SPOChannelMirror(position=entrancepos,
-                         orientation=transforms3d.euler.euler2mat(np.pi, 0,0,'sxyz'),
-                         id_num_offset=1000)
-lens1m = SPOChannelMirror(pos4d=np.dot(shift_optical_axis_12, lens1.pos4d),
-                          id_num_offset=10000)
-lens2m = SPOChannelMirror(pos4d=np.dot(shift_optical_axis_12, lens2.pos4d),
-                          id_num_offset=11000)
+@register('lens1')
+def _lens1():
+    return IndexedSPOChannelMirror(position=entrancepos,
+                            id_num_offset=0)
+
+
+@register('lens2')
+def _lens2():
+    return IndexedSPOChannelMirror(position=entrancepos,
+                            orientation=transforms3d.euler.euler2mat(np.pi, 0,0,'sxyz'),
+                            id_num_offset=1000)
+
+
+@register('lens1m')
+def _lens1m():
+    return IndexedSPOChannelMirror(pos4d=np.dot(shift_optical_axis_12, get('lens1').pos4d),
+                            id_num_offset=10000)
+
+
+@register('lens2m')
+def _lens2m():
+    return IndexedSPOChannelMirror(pos4d=np.dot(shift_optical_axis_12, get('lens2').pos4d),
+                            id_num_offset=11000)
+
+
 # Scatter as FWHM ~8 arcsec. Divide by 2.3545 to get Gaussian sigma.
-rms = RadialMirrorScatter(inplanescatter=10. / 2.3545 / 3600 / 180. * np.pi,
-                          perpplanescatter=1.5 / 2.345 / 3600. / 180. * np.pi,
-                          position=entrancepos, zoom=[1, 200, 820])
+@register('rms')
+def _rms():
+    return RadialMirrorScatter(inplanescatter=10. / 2.3545 / 3600 / 180. * np.pi,
+                               perpplanescatter=1.5 / 2.345 / 3600. / 180. * np.pi,
+                               position=entrancepos, zoom=[1, 200, 820])
+
 
-rmsm = RadialMirrorScatter(inplanescatter=10. / 2.3545 / 3600 / 180. * np.pi,
-                           perpplanescatter=1.5 / 2.345 / 3600. / 180. * np.pi,
-                           pos4d=np.dot(shift_optical_axis_12, rms.pos4d))
+@register('rmsm')
+def _rmsm():
+    return RadialMirrorScatter(inplanescatter=10. / 2.3545 / 3600 / 180. * np.pi,
+                               perpplanescatter=1.5 / 2.345 / 3600. / 180. * np.pi,
+                               pos4d=np.dot(shift_optical_axis_12, get('rms').pos4d))
 
 
 def spomounting(photons):
@@ -111,53 +275,119 @@ def spomounting(photons):
     return photons
 
 
-mirror = Sequence(elements=[lens1, lens2, rms,
-                            spogeometricthroughput, doublereflectivity,
-                            spomounting])
-mirrorm = Sequence(elements=[lens1m, lens2m, rmsm,
-                             spogeometricthroughput, doublereflectivity,
-                             spomounting])
-mirror4 = Sequence(elements=[lens1, lens2, lens1m, lens2m,
-                             rms, rmsm,
-                             spogeometricthroughput, doublereflectivity,
-                             spomounting])
+@register('mirror')
+def _mirror():
+    return Sequence(elements=[get('lens1'), get('lens2'), get('rms'),
+                              spogeometricthroughput, doublereflectivity,
+                              spomounting])
+
+
+@register('mirrorm')
+def _mirrorm():
+    return Sequence(elements=[get('lens1m'), get('lens2m'), get('rmsm'),
+                              spogeometricthroughput, doublereflectivity,
+                              spomounting])
+
+
+@register('mirror4')
+def _mirror4():
+    return Sequence(elements=[get('lens1'), get('lens2'),
+                              get('lens1m'), get('lens2m'),
+                              get('rms'), get('rmsm'),
+                              spogeometricthroughput, doublereflectivity,
+                              spomounting])
+
 
 # CAT grating
-order_selector = InterpolateRalfTable()
-gratquality = RalfQualityFactor()
+@register('order_selector')
+def _order_selector():
+    return InterpolateRalfTable()
+
+
+@register('gratquality')
+def _gratquality():
+    return RalfQualityFactor()
+
 
 blazemat = transforms3d.axangles.axangle2mat(np.array([0, 0, 1]),
                                              np.deg2rad(-blazeang))
 blazematm = transforms3d.axangles.axangle2mat(np.array([0, 0, 1]),
                                               np.deg2rad(blazeang))
 
-gratinggrid = {'rowland': rowland, 'd_element': 32., 'x_range': [1e4, 1.4e4],
-               'elem_class': CATGrating,
-               'elem_args': {'d': 2e-4, 'zoom': [1., 15., 15.],
-                             'orientation': blazemat,
-                             'order_selector': order_selector},
-               'normal_spec': np.array([0, 0., -z_offset_spectra, 1.])
-              }
-gas_1 = RectangularGrid(z_range=[300 - z_offset_spectra, 800 - z_offset_spectra],
-                        y_range=[-180, 180], **gratinggrid)
-gas_2 = RectangularGrid(z_range=[-800 + z_offset_spectra, -300 - z_offset_spectra],
-                        y_range=[-180, 180],
-                        id_num_offset=1000, **gratinggrid)
-gas = Sequence(elements=[gas_1, gas_2, catsupport, catsupportbars, gratquality])
-
-gratinggrid['rowland'] = rowlandm
-gratinggrid['elem_args']['orientation'] = blazematm
-gratinggrid['normal_spec'] = np.array([0, 2 * d, z_offset_spectra, 1.])
-gas_1m = RectangularGrid(z_range=[300 + z_offset_spectra, 800 + z_offset_spectra],
-                         y_range=[-180 + 2 * d, 180 + 2 * d],
-                         id_num_offset=10000, **gratinggrid)
-gas_2m = RectangularGrid(z_range=[-800 + z_offset_spectra, -300 + z_offset_spectra],
-                         y_range=[-180 + 2* d, 180 + 2 * d],
-                         id_num_offset=11000, **gratinggrid)
-gasm = Sequence(elements=[gas_1m, gas_2m,
-                          catsupport, catsupportbars, gratquality])
-gas4 = Sequence(elements=[gas_1, gas_2, gas_1m, gas_2m,
-                          catsupport, catsupportbars, gratquality])
+
+def gratinggrid(rowland, orientation, normal_spec):
+    '''Arguments for a `RectangularGrid` of CAT gratings.
+
+    Parameters
+    ----------
+    rowland : `marxs.design.rowland.RowlandTorus`
+        Rowland torus that the gratings are placed on.
+    orientation : np.array of shape (3, 3)
+        Rotation matrix of each grating (sets the blaze angle).
+    normal_spec : np.array of shape (4, )
+        Point in homogeneous coordinates that the grating normals point to.
+    '''
+    return {'rowland': rowland, 'd_element': 32., 'x_range': [1e4, 1.4e4],
+            'elem_class': CATGrating,
+            'elem_args': {'d': 2e-4, 'zoom': [1., 15., 15.],
+                          'orientation': orientation,
+                          'order_selector': get('order_selector')},
+            'normal_spec': normal_spec
+           }
+
+
+@register('gas_1')
+def _gas_1():
+    return IndexedRectangularGrid(z_range=[300 - z_offset_spectra, 800 - z_offset_spectra],
+                                  y_range=[-180, 180],
+                                  **gratinggrid(rowland, blazemat,
+                                                np.array([0, 0., -z_offset_spectra, 1.])))
+
+
+@register('gas_2')
+def _gas_2():
+    return IndexedRectangularGrid(z_range=[-800 + z_offset_spectra, -300 - z_offset_spectra],
+                                  y_range=[-180, 180],
+                                  id_num_offset=1000,
+                                  **gratinggrid(rowland, blazemat,
+                                                np.array([0, 0., -z_offset_spectra, 1.])))
+
+
+@register('gas')
+def _gas():
+    return Sequence(elements=[get('gas_1'), get('gas_2'), catsupport,
+                              catsupportbars, get('gratquality')])
+
+
+@register('gas_1m')
+def _gas_1m():
+    return IndexedRectangularGrid(z_range=[300 + z_offset_spectra, 800 + z_offset_spectra],
+                                  y_range=[-180 + 2 * d, 180 + 2 * d],
+                                  id_num_offset=10000,
+                                  **gratinggrid(rowlandm, blazematm,
+                                                np.array([0, 2 * d, z_offset_spectra, 1.])))
+
+
+@register('gas_2m')
+def _gas_2m():
+    return IndexedRectangularGrid(z_range=[-800 + z_offset_spectra, -300 + z_offset_spectra],
+                                  y_range=[-180 + 2* d, 180 + 2 * d],
+                                  id_num_offset=11000,
+                                  **gratinggrid(rowlandm, blazematm,
+                                                np.array([0, 2 * d, z_offset_spectra, 1.])))
+
+
+@register('gasm')
+def _gasm():
+    return Sequence(elements=[get('gas_1m'), get('gas_2m'),
+                              catsupport, catsupportbars, get('gratquality')])
+
+
+@register('gas4')
+def _gas4():
+    return Sequence(elements=[get('gas_1'), get('gas_2'),
+                              get('gas_1m'), get('gas_2m'),
+                              catsupport, catsupportbars, get('gratquality')])
 
 
 def get_filter(dir, name):
@@ -166,92 +396,194 @@ def get_filter(dir, name):
     return GlobalEnergyFilter(filterfunc=interp1d(en, tab[tab.colnames[1]]),
                               name=name)
 
-filtersandqe = Sequence(elements=[get_filter(*n) for n in [('filters', 'sifilter'),
-                                                           ('filters', 'opticalblocking'),
-                                                           ('filters', 'uvblocking'),
-                                                           ('detectors', 'contam'),
-                                                           ('detectors', 'qe')]])
+
+@register('filtersandqe')
+def _filtersandqe():
+    return Sequence(elements=[get_filter(*n) for n in [('filters', 'sifilter'),
+                                                       ('filters', 'opticalblocking'),
+                                                       ('filters', 'uvblocking'),
+                                                       ('detectors', 'contam'),
+                                                       ('detectors', 'qe')]])
 
 detccdargs = {'pixsize': 0.024,'zoom': [1, 24.576, 12.288]}
 
+
 # 500 mu gap between detectors
 # Place only hand-selected 16 CCDs
-det_16 = RowlandCircleArray(rowland=rowland_central,
-                            elem_class=FlatDetector,
-                            elem_args=detccdargs,
-                            d_element=49.652, theta=[3.1255, 3.1853, 3.2416, 3.301])
-assert len(det_16.elements) == 16
+@register('det_16')
+def _det_16():
+    det_16 = IndexedRowlandCircleArray(rowland=rowland_central,
+                                       elem_class=FlatDetector,
+                                       elem_args=detccdargs,
+                                       d_element=49.652, theta=[3.1255, 3.1853, 3.2416, 3.301])
+    assert len(det_16.elements) == 16
+    return det_16
+
 
 # Put plenty of CCDs in the focal plane
-det = RowlandCircleArray(rowland=rowland_central,
-                         elem_class=FlatDetector,
-                         elem_args=detccdargs,
-                         d_element=49.652, theta=[np.pi - 0.2, np.pi + 0.5])
+@register('det')
+def _det():
+    return IndexedRowlandCircleArray(rowland=rowland_central,
+                                     elem_class=FlatDetector,
+                                     elem_args=detccdargs,
+                                     d_element=49.652, theta=[np.pi - 0.2, np.pi + 0.5])
+
 
 # This is just one way to establish a global coordinate system for
 # detection on detectors that follow a curved surface.
 # Project (not propagate) down to the focal plane.
-projectfp = marxs.analysis.ProjectOntoPlane()
+@register('projectfp')
+def _projectfp():
+    return marxs.analysis.ProjectOntoPlane()
+
 
 # Place an additional detector on the Rowland circle.
-detcirc = marxs.optics.CircularDetector.from_rowland(rowland_central, width=20)
-detcirc.loc_coos_name = ['detccent_phi', 'detccent_y']
-detcirc.detpix_name = ['detccentpix_x', 'detccentpix_y']
-detcirc.display['opacity'] = 0.0
+@register('detcirc')
+def _detcirc():
+    detcirc = marxs.optics.CircularDetector.from_rowland(rowland_central, width=20)
+    detcirc.loc_coos_name = ['detccent_phi', 'detccent_y']
+    detcirc.detpix_name = ['detccentpix_x', 'detccentpix_y']
+    detcirc.display['opacity'] = 0.0
+    return detcirc
+
 
 # Place an additional detector on the Rowland circle.
-detcirc2 = marxs.optics.CircularDetector.from_rowland(rowlandm, width=20)
-detcirc2.loc_coos_name = ['detc2_phi', 'detc2_y']
-detcirc2.detpix_name = ['detc2pix_x', 'detc2pix_y']
-detcirc2.display['opacity'] = 0.1
+@register('detcirc2')
+def _detcirc2():
+    detcirc2 = marxs.optics.CircularDetector.from_rowland(rowlandm, width=20)
+    detcirc2.loc_coos_name = ['detc2_phi', 'detc2_y']
+    detcirc2.detpix_name = ['detc2pix_x', 'detc2pix_y']
+    detcirc2.display['opacity'] = 0.1
+    return detcirc2
+
 
 # Place an additional detector on the Rowland circle.
-detcirc1 = marxs.optics.CircularDetector.from_rowland(rowland, width=20)
-detcirc1.loc_coos_name = ['detc1_phi', 'detc1_y']
-detcirc1.detpix_name = ['detc1_x', 'detc1_y']
-detcirc1.display['opacity'] = 0.1
+@register('detcirc1')
+def _detcirc1():
+    detcirc1 = marxs.optics.CircularDetector.from_rowland(rowland, width=20)
+    detcirc1.loc_coos_name = ['detc1_phi', 'detc1_y']
+    detcirc1.detpix_name = ['detc1_x', 'detc1_y']
+    detcirc1.display['opacity'] = 0.1
+    return detcirc1
 
 
 # Place an additional detector in the focal plane for comparison
 # Detectors are transparent to allow this stuff
-detfp = marxs.optics.FlatDetector(zoom=[.2, 10000, 10000])
-detfp.loc_coos_name = ['detfp_x', 'detfp_y']
-detfp.detpix_name = ['detfppix_x', 'detfppix_y']
-detfp.display['opacity'] = 0.1
+@register('detfp')
+def _detfp():
+    detfp = marxs.optics.FlatDetector(zoom=[.2, 10000, 10000])
+    detfp.loc_coos_name = ['detfp_x', 'detfp_y']
+    detfp.detpix_name = ['detfppix_x', 'detfppix_y']
+    detfp.display['opacity'] = 0.1
+    return detfp
+
 
 ### Put together ARCUS in different configurations ###
-arcus = Sequence(elements=[aper, mirror, gas, filtersandqe, det_16,
-                           projectfp, tagversion])
-arcusm = Sequence(elements=[aperm, mirrorm, gasm, filtersandqe, det_16,
-                            projectfp, tagversion])
-keeppos4 = KeepCol('pos')
-arcus4 = Sequence(elements=[aper4, mirror4, gas4, filtersandqe, det_16,
-                            projectfp, tagversion],
-                  postprocess_steps=[keeppos4])
-arcus_for_plot = Sequence(elements=[aper, aperm, gas, gasm, det_16,
-                                    tagversion])
-
-keeppos = KeepCol('pos')
-keepposm = KeepCol('pos')
-
-arcus_extra_det4 = Sequence(elements=[aper4, mirror4, gas4, filtersandqe,
-                                      detcirc, detcirc1, detcirc2, det,
-                                      projectfp, detfp,
-                                      tagversion],
-                            postprocess_steps=[keeppos])
-
-arcus_extra_det = Sequence(elements=[aper, mirror, gas, filtersandqe,
-                                     detcirc, detcirc1, detcirc2, det,
-                                     projectfp, detfp,
-                                     tagversion],
-                           postprocess_steps=[keeppos])
-
-arcus_extra_det_m = Sequence(elements=[aperm, mirrorm, gasm, filtersandqe,
-                                       detcirc, detcirc1, detcirc2, det,
-                                       projectfp, detfp,
-                                       tagversion],
-                             postprocess_steps=[keepposm])
+@register('arcus')
+def _arcus():
+    return Sequence(elements=[get('aper'), get('mirror'), get('gas'),
+                              get('filtersandqe'), get('det_16'),
+                              get('projectfp'), tagversion])
+
+
+@register('arcusm')
+def _arcusm():
+    return Sequence(elements=[get('aperm'), get('mirrorm'), get('gasm'),
+                              get('filtersandqe'), get('det_16'),
+                              get('projectfp'), tagversion])
+
+
+@register('keeppos4')
+def _keeppos4():
+    return KeepCol('pos')
+
+
+@register('arcus4')
+def _arcus4():
+    return Sequence(elements=[get('aper4'), get('mirror4'), get('gas4'),
+                              get('filtersandqe'), get('det_16'),
+                              get('projectfp'), tagversion],
+                    postprocess_steps=[get('keeppos4')])
+
+
+@register('arcus_for_plot')
+def _arcus_for_plot():
+    return Sequence(elements=[get('aper'), get('aperm'), get('gas'),
+                              get('gasm'), get('det_16'), tagversion])
+
+
+@register('keeppos')
+def _keeppos():
+    return KeepCol('pos')
+
+
+@register('keepposm')
+def _keepposm():
+    return KeepCol('pos')
+
+
+@register('arcus_extra_det4')
+def _arcus_extra_det4():
+    return Sequence(elements=[get('aper4'), get('mirror4'), get('gas4'),
+                              get('filtersandqe'),
+                              get('detcirc'), get('detcirc1'), get('detcirc2'),
+                              get('det'), get('projectfp'), get('detfp'),
+                              tagversion],
+                    postprocess_steps=[get('keeppos')])
+
+
+@register('arcus_extra_det')
+def _arcus_extra_det():
+    return Sequence(elements=[get('aper'), get('mirror'), get('gas'),
+                              get('filtersandqe'),
+                              get('detcirc'), get('detcirc1'), get('detcirc2'),
+                              get('det'), get('projectfp'), get('detfp'),
+                              tagversion],
+                    postprocess_steps=[get('keeppos')])
+
+
+@register('arcus_extra_det_m')
+def _arcus_extra_det_m():
+    return Sequence(elements=[get('aperm'), get('mirrorm'), get('gasm'),
+                              get('filtersandqe'),
+                              get('detcirc'), get('detcirc1'), get('detcirc2'),
+                              get('det'), get('projectfp'), get('detfp'),
+                              tagversion],
+                    postprocess_steps=[get('keepposm')])
+
 
 # No detector effects - Joern's simulator handles that itself.
-arcus_joern = Sequence(elements=[aper, mirror, gas, detfp, tagversion])
-arcus_joernm = Sequence(elements=[aperm, mirrorm, gasm, detfp, tagversion])
+@register('arcus_joern')
+def _arcus_joern():
+    return Sequence(elements=[get('aper'), get('mirror'), get('gas'),
+                              get('detfp'), tagversion])
+
+
+@register('arcus_joernm')
+def _arcus_joernm():
+    return Sequence(elements=[get('aperm'), get('mirrorm'), get('gasm'),
+                              get('detfp'), tagversion])
+
+
+class _LazyModule(types.ModuleType):
+    '''Module type that builds registered elements on attribute access.
+
+    This keeps ``arcus.arcus.arcus4`` and ``from arcus.arcus import det``
+    working, although nothing is built when the module is imported.
+    '''
+    def __getattr__(self, name):
+        if name in _builders:
+            return get(name)
+        raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+
+
+try:
+    sys.modules[__name__].__class__ = _LazyModule
+except TypeError:
+    # Python 2 does not allow to change the class of a module, so replace the
+    # module by a lazy copy. The original module has to be kept alive, because
+    # its dictionary holds the globals for all functions defined above.
+    _lazy_module = _LazyModule(__name__, __doc__)
+    _lazy_module.__dict__.update(sys.modules[__name__].__dict__)
+    _lazy_module._original_module = sys.modules[__name__]
+    sys.modules[__name__] = _lazy_module
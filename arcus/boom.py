@@ -1,16 +1,21 @@
+import os
+
 import numpy as np
 from numpy.core.umath_tests import inner1d
+from astropy.table import Table
 
 from transforms3d.euler import euler2mat
 from transforms3d.affines import compose
 from marxs.optics import OpticalElement
 from marxs.math import pluecker
-from marxs.math.utils import h2e, norm_vector
+from marxs.math.utils import e2h, h2e, norm_vector
 from marxs.simulator import Parallel
+from marxs.base import MarxsElement
 
 # Beware of circular imports if the boom is ever needed
 # inside of arcus.py itself.
-from . import arcus
+from . import arcus, conf
+from .layout import hash_parameters
 # origin of coordinate system is one of the focal points.
 # center boom around mid-point between the two focal points.
 centerpos = [1000., arcus.d, 0]
@@ -137,3 +142,313 @@ class ThreeSidedBoom(Parallel):
                     fullboompos4d.append(np.dot(affmat, p))
 
         return fullboompos4d
+
+
+class BatchedThreeSidedBoom(ThreeSidedBoom):
+    '''Three-sided boom that tests photons against all rods at once.
+
+    `ThreeSidedBoom` loops over all rods and calls `Rod.intersect` for
+    each of them on the full photon list. This class stacks the geometry of
+    all rods into arrays and tests blocks of ``chunksize`` photons against
+    all rods in one vectorized computation. Photons whose ray passes
+    outside of a bounding cylinder around the whole boom are discarded
+    before that. The result in the ``hitrod`` column is the same as for
+    `ThreeSidedBoom`.
+
+    Parameters are the same as for `ThreeSidedBoom`.
+    '''
+    chunksize = 10000
+    '''Number of photons that are tested against all rods at the same time.
+
+    Memory use is proportional to ``chunksize`` times the number of rods.
+    '''
+
+    profile_children = False
+    '''Rods are not called one by one, see `arcus.profiling`.'''
+
+    def generate_elements(self):
+        super(BatchedThreeSidedBoom, self).generate_elements()
+        pos4d = np.array([e.pos4d for e in self.elements])
+        self.rod_center = pos4d[:, :3, 3]
+        self.rod_height = np.linalg.norm(pos4d[:, :3, 0], axis=1)
+        self.rod_radius = np.linalg.norm(pos4d[:, :3, 1], axis=1)
+        self.rod_e_x = pos4d[:, :3, 0] / self.rod_height[:, None]
+        # Bounding cylinder around the x-axis of the boom
+        inv = np.linalg.inv(self.pos4d)
+        ends = np.vstack([np.dot(e2h(self.rod_center + f * pos4d[:, :3, 0], 1),
+                                 inv.T)[:, :3] for f in [-1, 1]])
+        radius = np.tile(self.rod_radius, 2)
+        self.bound_radius = np.max(np.linalg.norm(ends[:, 1:], axis=1) + radius)
+        self.bound_x = [np.min(ends[:, 0] - radius), np.max(ends[:, 0] + radius)]
+
+    def in_bounding_cylinder(self, dir, pos):
+        '''Check which rays pass through the bounding cylinder of the boom.
+
+        Parameters
+        ----------
+        dir, pos : np.array of shape (N, 4)
+            Direction and position of the photons in homogeneous coordinates.
+
+        Returns
+        -------
+        inside : np.array of bool
+            ``False`` for rays that cannot hit any rod.
+        '''
+        inv = np.linalg.inv(self.pos4d)
+        pos = h2e(np.dot(pos, inv.T))
+        dir = np.dot(dir, inv.T)[:, :3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = [pos[:, 1:] + ((x - pos[:, 0]) / dir[:, 0])[:, None] * dir[:, 1:]
+                 for x in self.bound_x]
+            # Closest distance to the axis for the part of the ray between
+            # the two end planes of the cylinder.
+            dq = q[1] - q[0]
+            s = np.clip(-inner1d(q[0], dq) / inner1d(dq, dq), 0, 1)
+            s[~np.isfinite(s)] = 0
+            dist = np.linalg.norm(q[0] + s[:, None] * dq, axis=1)
+            return ~(dist > self.bound_radius)
+
+    def intersect_rods(self, dir, pos):
+        '''Check which rays hit any rod.
+
+        This uses the same calculation as `Rod.intersect`, but for all rods
+        at once.
+
+        Parameters
+        ----------
+        dir, pos : np.array of shape (N, 4)
+            Direction and position of the photons in homogeneous coordinates.
+
+        Returns
+        -------
+        intersect : np.array of bool
+        '''
+        pos = (pos[:, :3] / pos[:, [3]])[:, None, :]
+        dir = dir[:, None, :3]
+        center = self.rod_center[None, :, :]
+        e_x = self.rod_e_x[None, :, :]
+        height = self.rod_height[None, :]
+        radius = self.rod_radius[None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intersect = np.zeros((pos.shape[0], len(self.rod_center)), dtype=bool)
+            # ray passes through cylinder caps?
+            for fac in [-1, 1]:
+                cap_midpoint = center + fac * height[:, :, None] * e_x
+                t = inner1d(cap_midpoint - pos, e_x) / inner1d(dir, e_x)
+                interpos = pos + t[:, :, None] * dir
+                r = np.linalg.norm(cap_midpoint - interpos, axis=-1)
+                intersect |= r < radius
+            # Ray passes through the side of a cylinder
+            n = np.cross(e_x, dir)
+            n /= np.linalg.norm(n, axis=-1)[..., None]
+            d = np.abs(inner1d(n, center - pos))
+            n2 = np.cross(dir, n)
+            n2 /= np.linalg.norm(n2, axis=-1)[..., None]
+            k = inner1d(pos - center, n2) / inner1d(e_x, n2)
+            intersect |= (d < radius) & (np.abs(k) < height)
+        return intersect.any(axis=1)
+
+    def __call__(self, photons):
+        if len(self.preprocess_steps + self.postprocess_steps) > 0:
+            return super(BatchedThreeSidedBoom, self).__call__(photons)
+        outcol = self.elements[0].outcol
+        if outcol not in photons.colnames:
+            photons[outcol] = False
+        ind = self.in_bounding_cylinder(photons['dir'].data,
+                                        photons['pos'].data).nonzero()[0]
+        for start in range(0, len(ind), self.chunksize):
+            i = ind[start: start + self.chunksize]
+            photons[outcol][i] |= self.intersect_rods(photons['dir'].data[i],
+                                                      photons['pos'].data[i])
+        return photons
+
+
+class BoomShadowMap(MarxsElement):
+    '''Look up if a photon hits the boom in a precomputed shadow map.
+
+    For a fixed pointing, the direction of the photons that arrive at a
+    point of a reference plane perpendicular to the x-axis (e.g. the plane of
+    the mirror) is fixed, too, e.g. towards the focal point for photons that
+    leave the mirror. Whether a photon hits the boom then depends only on
+    the point where it crosses that plane. `rasterize` traces a sample of
+    photons through the instrument up to the boom and stores the mean
+    direction of the photons in each cell of a grid on the reference plane.
+    It then traces one ray through the center of each cell in that
+    direction through the boom. When the element is called, the ``hitrod``
+    column is set by looking up the cell of each photon.
+
+    Photons that cross the plane in a cell that no photon of the sample
+    passed through, or that deviate from the direction stored for that
+    cell by more than ``angle_tolerance``, are traced through the boom
+    directly. Their number is counted in ``n_traced``. Photons with
+    probability 0 are skipped, because they cannot contribute to any
+    result.
+
+    The accuracy is limited by the ``resolution``: The ray through a cell
+    center and the ray of a photon in that cell are up to
+    ``resolution / 2`` apart in each coordinate in the reference plane.
+
+    Parameters
+    ----------
+    boom : `ThreeSidedBoom`
+        Boom to calculate the shadow for.
+    x : float
+        x coordinate of the reference plane, e.g. the position of the mirror.
+    y_range, z_range : list of two floats
+        Extent of the map in the reference plane.
+    resolution : float
+        Size of a map cell in mm.
+    angle_tolerance : float
+        Maximal difference (in rad) between the direction of a photon and
+        the direction stored for its cell.
+    '''
+    def __init__(self, boom, x, y_range, z_range, resolution=1.,
+                 angle_tolerance=1e-4, **kwargs):
+        self.boom = boom
+        self.x = x
+        self.y_range = y_range
+        self.z_range = z_range
+        self.resolution = resolution
+        self.angle_tolerance = angle_tolerance
+        self.outcol = Rod.outcol
+        self.shape = (int(np.ceil((y_range[1] - y_range[0]) / resolution)),
+                      int(np.ceil((z_range[1] - z_range[0]) / resolution)))
+        # Nothing is covered before `rasterize` is run.
+        self.slope = np.nan * np.ones(self.shape + (2, ))
+        self.shadow = np.zeros(self.shape, dtype=bool)
+        self.n_traced = 0
+        super(BoomShadowMap, self).__init__(**kwargs)
+
+    def cache_file(self, key):
+        '''Name of the file that holds the map.'''
+        return os.path.join(conf.cache_dir, 'boomshadow',
+                            'shadow-{}.npz'.format(key))
+
+    def bin_rays(self, dir, pos):
+        '''Find the map cell for each ray.
+
+        Parameters
+        ----------
+        dir, pos : np.array of shape (N, 4)
+            Direction and position of the photons in homogeneous coordinates.
+
+        Returns
+        -------
+        cells : np.array of int
+            Index of the cell in the flattened map.
+        slope : np.array of shape (N, 2)
+            Direction of the rays as :math:`d_y / d_x` and :math:`d_z / d_x`.
+        inside : np.array of bool
+            ``False`` for rays that cross the plane outside of the map.
+        '''
+        pos = h2e(pos)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = dir[:, 1:3] / dir[:, [0]]
+            cross = pos[:, 1:] + (self.x - pos[:, [0]]) * slope
+            iy = np.floor((cross[:, 0] - self.y_range[0]) / self.resolution)
+            iz = np.floor((cross[:, 1] - self.z_range[0]) / self.resolution)
+            inside = ((iy >= 0) & (iy < self.shape[0]) &
+                      (iz >= 0) & (iz < self.shape[1]))
+        cells = np.where(inside, iy * self.shape[1] + iz, 0).astype(int)
+        return cells, slope, inside
+
+    def trace(self, dir, pos):
+        '''Trace rays through the boom.'''
+        if len(dir) == 0:
+            return np.zeros(0, dtype=bool)
+        photons = self.boom(Table({'pos': pos, 'dir': dir}))
+        return np.asarray(photons[self.outcol])
+
+    def rasterize(self, source, pointing, upstream, exposuretime,
+                  chunksize=1e5, seed=0):
+        '''Calculate the map for the beam of a source.
+
+        Photons are generated and traced in chunks with `arcus.run.iter_chunks`.
+        The state of the random number generator is restored afterwards.
+        The map is saved in ``conf.cache_dir`` and read from there if the
+        same beam is rasterized again for the same boom and grid.
+
+        Parameters
+        ----------
+        source : `marxs.source.Source`
+        pointing : `marxs.source.PointingModel`
+        upstream : callable
+            Elements before the boom, e.g. the aperture and the mirror.
+        exposuretime : float
+            Exposure time for the sample. It should be large enough that
+            photons pass through every map cell in the beam.
+        chunksize : float
+            Exposure time for each chunk.
+        seed : int
+            Seed for the sample.
+        '''
+        from . import run
+        n = self.shape[0] * self.shape[1]
+        counts = np.zeros(n)
+        sums = np.zeros((n, 2))
+        state = np.random.get_state()
+        try:
+            for photons in run.iter_chunks(source, pointing, upstream,
+                                           exposuretime, chunksize, seed=seed):
+                live = self.live(photons)
+                cells, slope, inside = self.bin_rays(photons['dir'].data[live],
+                                                     photons['pos'].data[live])
+                counts += np.bincount(cells[inside], minlength=n)
+                for i in range(2):
+                    sums[:, i] += np.bincount(cells[inside],
+                                              weights=slope[inside, i],
+                                              minlength=n)
+        finally:
+            np.random.set_state(state)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = sums / counts[:, None]
+        key = hash_parameters(self.boom.__class__.__name__,
+                              [e.pos4d for e in self.boom.elements],
+                              self.x, self.y_range, self.z_range,
+                              self.resolution, slope)
+        filename = self.cache_file(key)
+        if os.path.exists(filename):
+            shadow = np.load(filename, allow_pickle=False)['shadow']
+        else:
+            shadow = np.zeros(n, dtype=bool)
+            cells = (counts > 0).nonzero()[0]
+            iy, iz = np.unravel_index(cells, self.shape)
+            pos = np.ones((len(cells), 4))
+            pos[:, 0] = self.x
+            pos[:, 1] = self.y_range[0] + (iy + 0.5) * self.resolution
+            pos[:, 2] = self.z_range[0] + (iz + 0.5) * self.resolution
+            dir = np.zeros((len(cells), 4))
+            dir[:, 0] = 1.
+            dir[:, 1:3] = slope[cells]
+            shadow[cells] = self.trace(dir, pos)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            tempname = '{}.{}.tmp'.format(filename, os.getpid())
+            with open(tempname, 'wb') as f:
+                np.savez(f, shadow=shadow)
+            os.rename(tempname, filename)
+        self.slope = slope.reshape(self.shape + (2, ))
+        self.shadow = shadow.reshape(self.shape)
+
+    def live(self, photons):
+        '''Indices of photons with probability > 0.'''
+        if 'probability' not in photons.colnames:
+            return np.arange(len(photons))
+        return (photons['probability'] > 0).nonzero()[0]
+
+    def __call__(self, photons):
+        ind = self.live(photons)
+        dir = photons['dir'].data[ind]
+        pos = photons['pos'].data[ind]
+        cells, slope, inside = self.bin_rays(dir, pos)
+        diff = np.abs(slope - self.slope.reshape((-1, 2))[cells])
+        with np.errstate(invalid='ignore'):
+            found = inside & np.all(diff <= self.angle_tolerance, axis=1)
+        hit = np.zeros(len(ind), dtype=bool)
+        hit[found] = self.shadow.ravel()[cells[found]]
+        hit[~found] = self.trace(dir[~found], pos[~found])
+        self.n_traced += (~found).sum()
+        if self.outcol not in photons.colnames:
+            photons[self.outcol] = False
+        photons[self.outcol][ind] |= hit
+        return photons
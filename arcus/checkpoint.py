@@ -0,0 +1,292 @@
+'''Save the photons after a stage of a simulation and reuse them.
+
+In design studies the same source is often traced through the same
+aperture and mirror many times, while only later stages (e.g. the grating
+grid or the detector layout) change. `add_checkpoint` replaces all elements
+of a sequence up to a given stage by a single `Checkpoint` element, which
+saves its output photon list in ``conf.cache_dir`` and returns the saved
+photons when it is called again with the same input.
+
+The saved photons are identified by a hash of
+
+- the input photon list (which depends on the source, the pointing and the
+  exposure time),
+- the state of the numpy random number generator (which depends on the
+  seed) and
+- the parameters of all elements up to the stage (see `fingerprint`).
+
+The state of the random number generator after the stage is saved with the
+photons and restored when they are reused, so the result of a simulation is
+the same whether the checkpoint was used or not.
+
+Photons are saved in the same format as the compiled caldb (see
+`arcus.load_csv.compile_caldb`): a numpy ".npz" file with one array per
+column and a JSON index for units, descriptions, meta data and the state of
+the random number generator. Loading such a file does not execute any code
+and does not depend on the Python or astropy version.
+'''
+import os
+import json
+import glob
+import types
+import numbers
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import astropy.units as u
+from astropy.table import Table, Column, MaskedColumn
+from marxs.base import MarxsElement
+from marxs.simulator import Sequence, KeepCol
+
+from . import conf
+from .compact import Compact
+from .layout import hash_parameters
+
+_ignore_attributes = [(KeepCol, ['data']),
+                      (Compact, ['n_in', 'n_removed', 'removed'])]
+'''Attributes that hold records of earlier calls and not parameters.'''
+
+_run_meta = ['SIMDATE', 'SIMTIME', 'SIMUSER', 'SIMHOST']
+'''Keywords in the photon meta data that describe the run, not the photons.'''
+
+
+def fingerprint(obj, _seen=None):
+    '''Convert an element and all its parameters into basic types.
+
+    Objects are represented by their class and all attributes in their
+    ``__dict__`` (recursively), functions by their name, byte code,
+    constants and the content of their closure. The result can be passed to
+    `arcus.layout.hash_parameters`. Attributes that only record earlier
+    calls (e.g. the data of `marxs.simulator.KeepCol`) are skipped.
+
+    Parameters
+    ----------
+    obj : object
+        Element (or any parameter of an element).
+
+    Returns
+    -------
+    fingerprint : list or basic type
+    '''
+    if _seen is None:
+        _seen = set()
+    if obj is None or isinstance(obj, (numbers.Number, str, bytes, np.ndarray)):
+        return obj
+    if isinstance(obj, u.Quantity):
+        return [obj.value, obj.unit.to_string()]
+    if isinstance(obj, (list, tuple)):
+        return [fingerprint(o, _seen) for o in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted([fingerprint(o, _seen) for o in obj], key=repr)
+    if isinstance(obj, dict):
+        return dict((str(k), fingerprint(v, _seen)) for k, v in obj.items())
+    if isinstance(obj, types.CodeType):
+        return [obj.co_name, obj.co_code, fingerprint(list(obj.co_consts), _seen)]
+    if isinstance(obj, types.FunctionType):
+        closure = [c.cell_contents for c in (obj.__closure__ or [])]
+        return [obj.__module__, fingerprint(obj.__code__, _seen),
+                fingerprint(closure, _seen),
+                fingerprint(obj.__defaults__, _seen)]
+    if isinstance(obj, types.MethodType):
+        return [fingerprint(obj.__func__, _seen), fingerprint(obj.__self__, _seen)]
+    # Objects that appear more than once (or refer to themselves) are
+    # described only the first time.
+    if id(obj) in _seen:
+        return 'seen: {}'.format(obj.__class__.__name__)
+    _seen.add(id(obj))
+    name = '{}.{}'.format(obj.__class__.__module__, obj.__class__.__name__)
+    if not hasattr(obj, '__dict__'):
+        return [name, repr(obj)]
+    ignore = sum([attrs for cls, attrs in _ignore_attributes
+                  if isinstance(obj, cls)], [])
+    return [name, dict((k, fingerprint(v, _seen))
+                       for k, v in vars(obj).items() if k not in ignore)]
+
+
+def _photons_parameters(photons):
+    meta = dict((k, v) for k, v in photons.meta.items() if k not in _run_meta)
+    return [photons.colnames, [photons[c].data for c in photons.colnames],
+            fingerprint(meta)]
+
+
+def checkpoint_dir():
+    '''Directory for saved photon lists.'''
+    return os.path.join(conf.cache_dir, 'checkpoint')
+
+
+def clear_checkpoints():
+    '''Delete all saved photon lists.
+
+    Returns
+    -------
+    n : int
+        Number of deleted files.
+    '''
+    files = glob.glob(os.path.join(checkpoint_dir(), '*.npz'))
+    for f in files:
+        os.remove(f)
+    return len(files)
+
+
+def _json_default(obj):
+    # Numbers in the meta data are often numpy scalars.
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('{} cannot be saved in a checkpoint.'.format(repr(obj)))
+
+
+def write_photons(filename, photons, state):
+    '''Save a photon list and the state of the random number generator.
+
+    Parameters
+    ----------
+    filename : string
+    photons : `astropy.table.Table`
+        Masked columns are not supported and all meta data must be
+        representable in JSON.
+    state : tuple
+        As returned by ``np.random.get_state()``.
+    '''
+    if any(isinstance(c, MaskedColumn) for c in photons.columns.values()):
+        raise TypeError('Masked columns cannot be saved in a checkpoint.')
+    arrays = {'__rngkeys__': state[1]}
+    columns = []
+    for col in photons.columns.values():
+        arrayname = 'c{}'.format(len(columns))
+        arrays[arrayname] = np.asarray(col)
+        columns.append({'name': col.name, 'array': arrayname,
+                        'unit': None if col.unit is None else col.unit.to_string(),
+                        'description': col.description,
+                        'format': col.format})
+    index = {'columns': columns,
+             'meta': list(photons.meta.items()),
+             'rngstate': [state[0]] + list(state[2:])}
+    arrays['__index__'] = np.array(json.dumps(index, default=_json_default))
+    # Write to a temporary file first, so that other processes never read
+    # a partially written file.
+    tempname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tempname, 'wb') as fh:
+        np.savez(fh, **arrays)
+    os.rename(tempname, filename)
+
+
+def read_photons(filename):
+    '''Read a photon list saved with `write_photons`.
+
+    Returns
+    -------
+    photons : `astropy.table.Table`
+    state : tuple
+        State of the random number generator, see ``np.random.set_state``.
+    '''
+    arrays = np.load(filename, allow_pickle=False)
+    index = json.loads(arrays['__index__'].item())
+    # marxs stores keywords as (value, comment) tuples, which JSON turns
+    # into lists.
+    meta = OrderedDict((k, tuple(v) if isinstance(v, list) else v)
+                       for k, v in index['meta'])
+    photons = Table(meta=meta)
+    for col in index['columns']:
+        photons.add_column(Column(arrays[col['array']], name=col['name'],
+                                  unit=col['unit'],
+                                  description=col['description'],
+                                  format=col['format']))
+    rng = index['rngstate']
+    state = (str(rng[0]), arrays['__rngkeys__']) + tuple(rng[1:])
+    return photons, state
+
+
+class Checkpoint(MarxsElement):
+    '''Pass photons through a sequence of elements and save the result.
+
+    Parameters
+    ----------
+    elements : list
+        Elements that photons are passed through, in order.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of calls where saved photons were used or where photons were
+        traced and saved.
+    '''
+    def __init__(self, elements, **kwargs):
+        self.sequence = Sequence(elements=elements)
+        self.hits = 0
+        self.misses = 0
+        super(Checkpoint, self).__init__(**kwargs)
+
+    def key(self, photons):
+        '''Hash that identifies the output for a given input photon list.'''
+        return hash_parameters(self.__class__.__name__,
+                               _photons_parameters(photons),
+                               fingerprint(np.random.get_state()),
+                               fingerprint(self.sequence.elements))
+
+    def cache_file(self, photons):
+        '''Name of the file that holds the output for these photons.'''
+        return os.path.join(checkpoint_dir(), '{}.npz'.format(self.key(photons)))
+
+    def __call__(self, photons):
+        filename = self.cache_file(photons)
+        if os.path.exists(filename):
+            saved, state = read_photons(filename)
+            np.random.set_state(state)
+            # Keep the description of this run, not the one that saved them.
+            for k in _run_meta:
+                if k in photons.meta:
+                    saved.meta[k] = photons.meta[k]
+            photons = saved
+            self.hits += 1
+            logging.info('Photons after checkpoint read from {}'.format(filename))
+            return photons
+        photons = self.sequence(photons)
+        self.misses += 1
+        if not os.path.isdir(checkpoint_dir()):
+            os.makedirs(checkpoint_dir())
+        try:
+            write_photons(filename, photons, np.random.get_state())
+        except TypeError as e:
+            logging.warning('Photons after checkpoint not saved: {}'.format(e))
+        return photons
+
+
+def add_checkpoint(instrument, stage):
+    '''Save and reuse the photons after a stage of an instrument.
+
+    The input sequence is not changed. Optical elements are shared with
+    the input.
+
+    Parameters
+    ----------
+    instrument : `marxs.simulator.Sequence`
+        Instrument, e.g. ``arcus.arcus.arcus``.
+    stage : element or string
+        Element of ``instrument.elements`` after which the photons are
+        saved. Strings are taken as names of ARCUS elements (see
+        `arcus.arcus.get`), e.g. ``'mirror'``.
+
+    Returns
+    -------
+    instrument : `marxs.simulator.Sequence`
+        New sequence, where all elements up to and including ``stage`` are
+        replaced by a `Checkpoint`, which is also available as the
+        attribute ``checkpoint`` of the new sequence. The pre- and
+        postprocess steps of ``instrument`` are run once before and after
+        the `Checkpoint`, instead of before and after each of the elements
+        it replaces.
+    '''
+    if isinstance(stage, str):
+        from . import arcus
+        stage = arcus.get(stage)
+    index = [i for i, e in enumerate(instrument.elements) if e is stage]
+    if len(index) == 0:
+        raise ValueError('The stage is not an element of the instrument.')
+    n = index[0] + 1
+    checkpoint = Checkpoint(instrument.elements[:n])
+    new = Sequence(elements=[checkpoint] + instrument.elements[n:],
+                   preprocess_steps=instrument.preprocess_steps,
+                   postprocess_steps=instrument.postprocess_steps)
+    new.checkpoint = checkpoint
+    return new
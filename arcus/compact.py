@@ -0,0 +1,153 @@
+'''Remove photons with zero probability between stages of a simulation.
+
+Several elements of ARCUS set the probability of photons to 0, e.g.
+``spomounting`` for photons that hit the frame of a petal between the
+SPOs or ``catsupportbars`` for photons that miss all grating facets. Those
+photons are still passed through all later elements. `add_compaction`
+inserts `Compact` steps after selected stages, so that later stages only
+process photons that can still be detected.
+
+Photons with zero probability never contribute to any result (e.g. an
+effective area is the sum of the probabilities divided by the number of
+photons that entered the aperture), so compaction does not change the
+results, but the photon list that comes out of the simulation is shorter.
+Elements after a `Compact` step that draw random numbers (e.g. the order
+selection of the CAT gratings) draw fewer of them, so for a given seed the
+results are statistically equivalent, but not identical to a simulation
+without compaction.
+
+`marxs.simulator.KeepCol` steps in the ``preprocess_steps`` or
+``postprocess_steps`` of a sequence record a column after every element.
+So that all recorded arrays keep the same length, a `Compact` step also
+removes the rows of the dead photons from the arrays that the `KeepCol`
+steps of all enclosing sequences recorded earlier in the same call. As
+usual, the data of a `KeepCol` should be cleared between two calls of the
+instrument (see `arcus.run.clear_keepcol`).
+'''
+import copy
+
+from astropy.table import vstack
+from marxs.base import MarxsElement
+from marxs.simulator import Sequence, KeepCol
+
+
+class Compact(MarxsElement):
+    '''Remove photons with zero probability from the photon list.
+
+    Parameters
+    ----------
+    keep_removed : bool
+        If ``True``, the removed photons are kept in `removed` instead of
+        being discarded.
+    metakey : string or ``None``
+        If set, the number of removed photons is recorded in the meta data
+        of the photon list under this key.
+    keepcols : list of `marxs.simulator.KeepCol`
+        Removed photons are also removed from the arrays recorded by these
+        steps in the current call, i.e. from all arrays at the end of their
+        ``data`` that have the length of the input photon list.
+
+    Attributes
+    ----------
+    n_in : int
+        Number of photons that were passed to this element so far.
+    n_removed : int
+        Number of photons that were removed so far.
+    removed : list of `astropy.table.Table`
+        Removed photons for every call (only if ``keep_removed=True``).
+    '''
+    def __init__(self, keep_removed=False, metakey=None, keepcols=[],
+                 **kwargs):
+        self.keep_removed = keep_removed
+        self.metakey = metakey
+        self.keepcols = keepcols
+        self.reset()
+        super(Compact, self).__init__(**kwargs)
+
+    def reset(self):
+        '''Set the counters to zero and discard removed photons.'''
+        self.n_in = 0
+        self.n_removed = 0
+        self.removed = []
+
+    def __call__(self, photons):
+        live = photons['probability'] != 0
+        n_removed = len(photons) - live.sum()
+        self.n_in += len(photons)
+        self.n_removed += n_removed
+        if self.keep_removed:
+            self.removed.append(photons[~live])
+        if self.metakey is not None:
+            photons.meta[self.metakey] = (n_removed, 'Photons removed with probability 0')
+        if n_removed == 0:
+            return photons
+        for keepcol in self.keepcols:
+            i = len(keepcol.data)
+            while i > 0 and len(keepcol.data[i - 1]) == len(photons):
+                i -= 1
+            keepcol.data[i:] = [d[live] for d in keepcol.data[i:]]
+        return photons[live]
+
+    @property
+    def removed_photons(self):
+        '''All removed photons in one table.'''
+        return vstack(self.removed, metadata_conflicts='silent')
+
+
+def _insert_compaction(element, after, steps, found, keepcols=[]):
+    if not isinstance(element, Sequence):
+        return element
+    keepcols = keepcols + [s for s in element.preprocess_steps +
+                           element.postprocess_steps if isinstance(s, KeepCol)]
+    elements = []
+    for e in element.elements:
+        elements.append(_insert_compaction(e, after, steps, found, keepcols))
+        if any(e is a for a in after):
+            found.add(id(e))
+            steps.append(Compact(metakey='COMPACT{}'.format(len(steps) + 1),
+                                 keepcols=keepcols))
+            elements.append(steps[-1])
+    # Copy instead of changing elements in place, because sequences are
+    # shared between configurations.
+    new = copy.copy(element)
+    new.elements = elements
+    return new
+
+
+def add_compaction(element, after):
+    '''Insert `Compact` steps after selected elements of a sequence.
+
+    The input sequence is not changed; a copy of all nested sequences is
+    made. Optical elements are shared with the input.
+
+    Parameters
+    ----------
+    element : `marxs.simulator.Sequence`
+        Instrument, e.g. ``arcus.arcus.arcus4``.
+    after : list
+        Elements after which photons with zero probability are removed.
+        Elements are searched for in all nested sequences. Strings are
+        taken as names of ARCUS elements (see `arcus.arcus.get`), e.g.
+        ``['mirror4', 'gas4']``.
+
+    Returns
+    -------
+    element : `marxs.simulator.Sequence`
+        New sequence with `Compact` steps. It has an attribute
+        ``compaction`` that lists those steps in order. The number of
+        photons removed by each step is also recorded in the photon meta
+        data as ``COMPACT1``, ``COMPACT2``, etc.
+    '''
+    resolved = []
+    for a in after:
+        if isinstance(a, str):
+            from . import arcus
+            a = arcus.get(a)
+        resolved.append(a)
+    steps = []
+    found = set()
+    new = _insert_compaction(element, resolved, steps, found)
+    if any(id(a) not in found for a in resolved):
+        raise ValueError('Not all elements listed in "after" are part of the sequence.')
+    new.compaction = steps
+    return new
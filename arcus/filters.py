@@ -0,0 +1,165 @@
+'''Combine energy dependent filters into a single element.
+
+Several elements of ARCUS reduce the probability of a photon based on its
+energy alone (`marxs.optics.GlobalEnergyFilter`), e.g. the reflectivity of
+the SPOs, the transmission of the grating support structure, the optical
+blocking filters and the QE of the CCDs. Because they do not depend on the
+position or direction of the photon, they commute with all other elements
+in the sequence and their product can be calculated once for all energies.
+`fuse_energy_filters` replaces all of them with one `CombinedEnergyFilter`.
+'''
+import re
+import copy
+
+import numpy as np
+from scipy.interpolate import interp1d
+from marxs.optics import GlobalEnergyFilter
+from marxs.simulator import Sequence
+
+
+def default_energy_grid(filters, oversample=4):
+    '''Energy grid that resolves the transmission curves of all filters.
+
+    The grid contains all nodes of those filters that are interpolated
+    tables (`scipy.interpolate.interp1d`) and is limited to the range where
+    all those tables are defined. Each interval is split into
+    ``oversample`` sub-intervals, because the product of two linear
+    interpolations is not linear between the nodes.
+
+    Parameters
+    ----------
+    filters : list of `marxs.optics.GlobalEnergyFilter`
+    oversample : int
+        Number of sub-intervals for every interval between two nodes.
+
+    Returns
+    -------
+    energy_grid : np.array
+        Energies in keV.
+    '''
+    tables = [f.filterfunc for f in filters
+              if isinstance(f.filterfunc, interp1d)]
+    if len(tables) == 0:
+        raise ValueError('An energy grid is required if none of the filters is an interpolated table.')
+    emin = max(t.x.min() for t in tables)
+    emax = min(t.x.max() for t in tables)
+    nodes = np.unique(np.hstack([t.x for t in tables]))
+    nodes = nodes[(nodes >= emin) & (nodes <= emax)]
+    steps = np.arange(oversample) / float(oversample)
+    grid = nodes[:-1, None] + steps[None, :] * np.diff(nodes)[:, None]
+    return np.hstack([grid.ravel(), nodes[-1:]])
+
+
+def _colname(f, i):
+    if isinstance(f.name, str):
+        name = re.sub('[^0-9a-zA-Z]+', '_', f.name).strip('_')
+        if name:
+            return 'trans_' + name
+    return 'trans_{}'.format(i)
+
+
+class CombinedEnergyFilter(GlobalEnergyFilter):
+    '''Apply the product of several energy dependent filters in one step.
+
+    The combined transmission is tabulated on ``energy_grid`` and linearly
+    interpolated. Photons with energies outside of the grid raise a
+    ``ValueError``, just like the interpolated tables of the individual
+    filters.
+
+    Parameters
+    ----------
+    filters : list of `marxs.optics.GlobalEnergyFilter`
+        Filters to combine.
+    energy_grid : np.array or ``None``
+        Energies (in keV) for the tabulated transmission. If ``None``, the
+        grid is generated with `default_energy_grid`.
+    keep_components : bool
+        If ``True``, the transmission of every filter is also written to a
+        column of the photon list, named ``trans_<name of filter>``.
+    '''
+    def __init__(self, filters, energy_grid=None, keep_components=False,
+                 **kwargs):
+        self.filters = list(filters)
+        if energy_grid is None:
+            energy_grid = default_energy_grid(self.filters)
+        self.energy_grid = np.asanyarray(energy_grid, dtype=float)
+        self.component_transmission = np.ones((len(self.filters),
+                                               len(self.energy_grid)))
+        for i, f in enumerate(self.filters):
+            self.component_transmission[i, :] = f.filterfunc(self.energy_grid)
+        self.transmission = np.prod(self.component_transmission, axis=0)
+        self.keep_components = keep_components
+        self.component_colnames = [_colname(f, i)
+                                   for i, f in enumerate(self.filters)]
+        self._componentfunc = interp1d(self.energy_grid,
+                                       self.component_transmission)
+        kwargs['filterfunc'] = interp1d(self.energy_grid, self.transmission)
+        kwargs.setdefault('name', 'combined energy filter')
+        super(CombinedEnergyFilter, self).__init__(**kwargs)
+
+    def __call__(self, photons):
+        if self.keep_components:
+            components = self._componentfunc(photons['energy'])
+            for i, col in enumerate(self.component_colnames):
+                photons[col] = components[i, :]
+        return super(CombinedEnergyFilter, self).__call__(photons)
+
+
+def find_energy_filters(element):
+    '''List all `marxs.optics.GlobalEnergyFilter` elements in a sequence.
+
+    `marxs.simulator.Sequence` objects are searched recursively; other
+    containers are not, because their elements act only on some photons.
+    '''
+    if isinstance(element, GlobalEnergyFilter):
+        return [element]
+    if isinstance(element, Sequence):
+        return sum([find_energy_filters(e) for e in element.elements], [])
+    return []
+
+
+def _replace_filters(element, combined, state):
+    if isinstance(element, GlobalEnergyFilter):
+        if state['inserted']:
+            return None
+        state['inserted'] = True
+        return combined
+    if isinstance(element, Sequence):
+        elements = [_replace_filters(e, combined, state)
+                    for e in element.elements]
+        # Copy instead of changing elements in place, because sequences
+        # such as ``filtersandqe`` are shared between configurations.
+        new = copy.copy(element)
+        new.elements = [e for e in elements if e is not None]
+        return new
+    return element
+
+
+def fuse_energy_filters(element, energy_grid=None, keep_components=False):
+    '''Replace all global energy filters in a sequence by a single filter.
+
+    The combined filter is placed where the first energy filter was, all
+    other energy filters are removed. The input sequence is not changed;
+    a copy of all nested sequences is made. Optical elements are not copied
+    and are shared with the input.
+
+    Parameters
+    ----------
+    element : `marxs.simulator.Sequence`
+        Instrument, e.g. ``arcus.arcus.arcus4``.
+    energy_grid : np.array or ``None``
+        See `CombinedEnergyFilter`.
+    keep_components : bool
+        See `CombinedEnergyFilter`.
+
+    Returns
+    -------
+    element : `marxs.simulator.Sequence`
+        New sequence with one `CombinedEnergyFilter`.
+    '''
+    filters = find_energy_filters(element)
+    if len(filters) == 0:
+        return element
+    combined = CombinedEnergyFilter(filters, energy_grid=energy_grid,
+                                    keep_components=keep_components)
+    return _replace_filters(element, combined, {'inserted': False})
@@ -0,0 +1,332 @@
+'''Arrays of gratings and detectors with a persistent cache for their layout.
+
+Placing elements on the Rowland torus requires a numerical root search for
+every element. The resulting positions depend only on the parameters of the
+torus and of the array, so they are saved in ``conf.cache_dir`` and reloaded
+the next time an array with the same parameters is set up.
+
+Arrays with many elements can also use a spatial index to find the elements
+that a photon may hit, instead of testing every photon against every
+element (see `PlanarIndexMixin`).
+'''
+import os
+import hashlib
+
+import numpy as np
+import marxs
+from marxs.design.rowland import RectangularGrid, RowlandCircleArray
+from marxs.math.utils import h2e
+
+from . import conf
+from .spatialindex import RectangleIndex
+
+use_cache = True
+'''Set to ``False`` to always calculate the positions of the elements.'''
+
+
+def hash_parameters(*args):
+    '''Calculate a hash that identifies a set of parameters.
+
+    Numbers, strings, numpy arrays and (possibly nested) lists, tuples and
+    dictionaries of those are supported. Numbers are hashed through their
+    ``repr``, so floats that differ in the last digit give different hashes.
+
+    Returns
+    -------
+    hash : string
+        Hex digest of the hash.
+    '''
+    h = hashlib.sha1()
+
+    def update(obj):
+        if isinstance(obj, np.ndarray):
+            h.update(str(obj.dtype).encode('ascii'))
+            h.update(repr(obj.shape).encode('ascii'))
+            h.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, (list, tuple)):
+            h.update(b'[')
+            for o in obj:
+                update(o)
+            h.update(b']')
+        elif isinstance(obj, dict):
+            h.update(b'{')
+            for k in sorted(obj):
+                update(k)
+                update(obj[k])
+            h.update(b'}')
+        else:
+            h.update(repr(obj).encode('utf-8'))
+        h.update(b';')
+
+    update(args)
+    return h.hexdigest()
+
+
+class LayoutCacheMixin(object):
+    '''Cache the result of ``calculate_elempos`` on disk.
+
+    Derived classes implement `layout_parameters`, which has to return
+    all parameters that the element positions depend on.
+    '''
+    def layout_parameters(self):
+        raise NotImplementedError
+
+    def layout_cache_file(self):
+        '''Name of the file that holds the positions for this layout.'''
+        key = hash_parameters(self.__class__.__name__, marxs.__version__,
+                              self.layout_parameters())
+        return os.path.join(conf.cache_dir, 'layout',
+                            '{}-{}.npy'.format(self.__class__.__name__, key))
+
+    def calculate_elempos(self):
+        if not use_cache:
+            return super(LayoutCacheMixin, self).calculate_elempos()
+        filename = self.layout_cache_file()
+        if os.path.exists(filename):
+            return list(np.load(filename))
+        pos4d = super(LayoutCacheMixin, self).calculate_elempos()
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        # Write to a temporary file first, so that other processes never read
+        # a partially written file.
+        tempname = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tempname, 'wb') as f:
+            np.save(f, np.array(pos4d))
+        os.rename(tempname, filename)
+        return pos4d
+
+
+def _rowland_parameters(rowland):
+    return [rowland.R, rowland.r, rowland.pos4d]
+
+
+class CachedRectangularGrid(LayoutCacheMixin, RectangularGrid):
+    '''`marxs.design.rowland.RectangularGrid` with cached element positions.'''
+    def layout_parameters(self):
+        return [_rowland_parameters(self.rowland), self.x_range, self.y_range,
+                self.z_range, self.d_element,
+                self.normal_spec, self.parallel_spec]
+
+
+class CachedRowlandCircleArray(LayoutCacheMixin, RowlandCircleArray):
+    '''`marxs.design.rowland.RowlandCircleArray` with cached element positions.'''
+    def layout_parameters(self):
+        return [_rowland_parameters(self.rowland), self.theta, self.d_element,
+                self.parallel_spec]
+
+
+def group_candidates(point, elem, n_elem, fallback):
+    '''Sort pairs of (photon, element) by element.
+
+    Parameters
+    ----------
+    point, elem : np.array of int
+        Index numbers of photons and elements for each candidate pair.
+    n_elem : int
+        Number of elements.
+    fallback : np.array of bool
+        Photons that are candidates for every element.
+
+    Returns
+    -------
+    candidates : list of np.array
+        Sorted index numbers of the photons for each element.
+    '''
+    order = np.argsort(elem, kind='mergesort')
+    bounds = np.searchsorted(elem[order], np.arange(n_elem + 1))
+    fallback = fallback.nonzero()[0]
+    return [np.union1d(point[order[bounds[i]: bounds[i + 1]]], fallback)
+            for i in range(n_elem)]
+
+
+class CandidateMixin(object):
+    '''Apply the elements of a `marxs.simulator.Parallel` to candidates only.
+
+    Derived classes implement `candidate_photons`, which returns for each
+    element the photons that might hit it. Each element is still applied
+    with its own ``intersect`` and ``process_photons`` and in the same order
+    as in `marxs.simulator.Parallel`, but only on its candidate photons.
+    Thus, random numbers are drawn in the same sequence and the result is
+    the same, as long as no photon that hits an element is missing from its
+    candidates.
+
+    Containers with ``preprocess_steps`` or ``postprocess_steps`` are
+    processed as a `marxs.simulator.Parallel`, because those steps have to
+    run for every element on the full photon list.
+    '''
+    profile_children = False
+    '''Elements are not called one by one, see `arcus.profiling`.'''
+
+    def candidate_photons(self, photons):
+        '''Find the photons that might hit each element.
+
+        Returns
+        -------
+        candidates : list of np.array
+            Index numbers of the photons for each element.
+        '''
+        raise NotImplementedError
+
+    def __call__(self, photons):
+        if len(self.preprocess_steps + self.postprocess_steps) > 0:
+            return super(CandidateMixin, self).__call__(photons)
+        n = len(photons)
+        intersect = np.zeros(n, dtype=bool)
+        interpos = np.zeros((n, 4))
+        intercoos = np.zeros((n, 2))
+        for elem, ind in zip(self.elements, self.candidate_photons(photons)):
+            if len(ind) == 0:
+                continue
+            # Read pos and dir again for every element, because earlier
+            # elements change them.
+            inter, pos, coos = elem.intersect(photons['dir'].data[ind],
+                                              photons['pos'].data[ind])
+            if not inter.any():
+                continue
+            intersect[:] = False
+            intersect[ind] = inter
+            interpos[ind] = pos
+            intercoos[ind] = coos
+            photons = elem.process_photons(photons, intersect, interpos,
+                                           intercoos)
+        return photons
+
+
+class PlanarIndexMixin(CandidateMixin):
+    '''Find candidate elements for each photon with a spatial index.
+
+    This is meant for `marxs.simulator.Parallel` containers of flat
+    elements that are arranged roughly in a plane perpendicular to the
+    x-axis, such as the CAT grating facets. Photons are propagated to a
+    reference plane at the median x position of the elements and looked
+    up in a `arcus.spatialindex.RectangleIndex` of the footprints of the
+    elements. The footprints are padded, because elements are tilted and
+    placed in front of or behind the reference plane; photons with a slope
+    relative to the x-axis larger than `max_slope` cannot be looked up and
+    are tested against all elements.
+    '''
+    max_slope = 0.2
+    '''Maximal slope ``|dir_y / dir_x|`` or ``|dir_z / dir_x|`` for the index.'''
+
+    def generate_elements(self):
+        super(PlanarIndexMixin, self).generate_elements()
+        self.index = self.build_index()
+
+    def build_index(self):
+        '''Set up a `arcus.spatialindex.RectangleIndex` for the elements.'''
+        pos4d = np.array([e.pos4d for e in self.elements])
+        center = pos4d[:, :3, 3]
+        v_y = pos4d[:, :3, 1]
+        v_z = pos4d[:, :3, 2]
+        self.x_ref = np.median(center[:, 0])
+        half_y = np.linalg.norm(v_y[:, 1:], axis=1)
+        half_z = np.linalg.norm(v_z[:, 1:], axis=1)
+        # Largest distance between any point of an element and the
+        # reference plane
+        dx = (np.abs(center[:, 0] - self.x_ref) +
+              np.abs(v_y[:, 0]) + np.abs(v_z[:, 0]))
+        return RectangleIndex(center[:, 1:], v_y[:, 1:] / half_y[:, None],
+                              v_z[:, 1:] / half_z[:, None], half_y, half_z,
+                              margin=self.max_slope * dx)
+
+    def candidate_photons(self, photons):
+        pos = h2e(photons['pos'].data)
+        dir = photons['dir'].data
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (self.x_ref - pos[:, 0]) / dir[:, 0]
+            points = pos[:, 1:3] + t[:, None] * dir[:, 1:3]
+            slope = np.max(np.abs(dir[:, 1:3] / dir[:, [0]]), axis=1)
+        cand = self.index.candidates(points)
+        # Also catches slope = nan.
+        fallback = ~(slope <= self.max_slope)
+        cand[fallback, :] = -1
+        point, k = (cand >= 0).nonzero()
+        return group_candidates(point, cand[point, k], len(self.elements),
+                                fallback)
+
+
+class RowlandCircleIndexMixin(CandidateMixin):
+    '''Find candidate elements on a Rowland circle from the angle of a photon.
+
+    This is meant for a `marxs.design.rowland.RowlandCircleArray`. Each
+    photon is intersected with the cylinder through the Rowland circle and
+    the angle of that point on the circle is looked up in a sorted table of
+    the angles of the element centers. Only the two elements with the
+    closest angles on either side are candidates. Photons that do not
+    intersect the cylinder are tested against all elements.
+    '''
+    def generate_elements(self):
+        super(RowlandCircleIndexMixin, self).generate_elements()
+        self.build_index()
+
+    def circle_angle(self, pos, dir=None):
+        '''Angle on the Rowland circle.
+
+        Parameters
+        ----------
+        pos : np.array of shape (N, 4)
+            Positions in homogeneous coordinates.
+        dir : np.array of shape (N, 4) or ``None``
+            If given, the angle is calculated for the point where the ray
+            with this direction leaves the cylinder through the Rowland
+            circle, otherwise for the projection of ``pos`` onto the plane
+            of the circle.
+
+        Returns
+        -------
+        theta : np.array of shape (N, )
+            Angle in the range ``theta_ref - pi`` to ``theta_ref + pi``.
+            ``np.nan`` for rays that do not intersect the cylinder.
+        '''
+        inv = np.linalg.inv(self.rowland.pos4d)
+        pos = h2e(np.dot(pos, inv.T))
+        x = pos[:, 0] - self.rowland.R
+        y = pos[:, 1]
+        if dir is not None:
+            dir = np.dot(dir, inv.T)
+            a = dir[:, 0]**2 + dir[:, 1]**2
+            b = 2 * (x * dir[:, 0] + y * dir[:, 1])
+            c = x**2 + y**2 - self.rowland.r**2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # The larger root is the point where the ray leaves the
+                # cylinder, i.e. on the opposite side from the gratings.
+                t = (-b + np.sqrt(b**2 - 4 * a * c)) / (2 * a)
+            x = x + t * dir[:, 0]
+            y = y + t * dir[:, 1]
+        return np.mod(np.arctan2(y, x) - self.theta_ref + np.pi,
+                      2 * np.pi) - np.pi + self.theta_ref
+
+    def build_index(self):
+        '''Sort the elements by their angle on the Rowland circle.'''
+        center = np.array([e.pos4d[:, 3] for e in self.elements])
+        self.theta_ref = 0.
+        theta = self.circle_angle(center)
+        # Angles are wrapped around the mean angle of the elements, so that
+        # an array that covers theta = pi is sorted correctly.
+        self.theta_ref = np.arctan2(np.mean(np.sin(theta)),
+                                    np.mean(np.cos(theta)))
+        theta = self.circle_angle(center)
+        self.index_order = np.argsort(theta)
+        self.index_theta = theta[self.index_order]
+
+    def candidate_photons(self, photons):
+        theta = self.circle_angle(photons['pos'].data, photons['dir'].data)
+        fallback = ~np.isfinite(theta)
+        theta[fallback] = 0
+        k = np.searchsorted(self.index_theta, theta)
+        n = len(self.elements)
+        point = np.arange(len(photons))[~fallback]
+        k = k[~fallback]
+        cand = [np.clip(k - 1, 0, n - 1), np.clip(k, 0, n - 1)]
+        return group_candidates(np.hstack([point, point]),
+                                self.index_order[np.hstack(cand)], n,
+                                fallback)
+
+
+class IndexedRectangularGrid(PlanarIndexMixin, CachedRectangularGrid):
+    '''`CachedRectangularGrid` that uses `PlanarIndexMixin` to find elements.'''
+
+
+class IndexedRowlandCircleArray(RowlandCircleIndexMixin,
+                                CachedRowlandCircleArray):
+    '''`CachedRowlandCircleArray` that uses `RowlandCircleIndexMixin` to find elements.'''
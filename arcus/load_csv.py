@@ -1,28 +1,88 @@
 import os
+import json
+import hashlib
 import logging
+import argparse
 import subprocess
-from astropy.table import Table
+from collections import OrderedDict
+import numpy as np
+from astropy.table import Table, Column, MaskedColumn
 import astropy.units as u
 from . import conf
+from .timeline import timeline
 
 hash_displayed = False
 
+cache_maxsize = 64
+'''Maximal number of parsed tables held in the in-process cache.'''
+
+_table_cache = OrderedDict()
+_cache_stats = {'hits': 0, 'misses': 0}
+_compiled = {}
+_git_info = {}
+
 
 class DataFileFormatException(Exception):
     pass
 
 
+def git_stamp_path():
+    '''Location of the stamp file that holds the version of the caldb.'''
+    return os.path.join(conf.caldb_inputdata, '.gitstamp')
+
+
+def _git_provenance():
+    '''Find git hash and commit date of the caldb-inputdata repository.
+
+    Spawning git processes is slow compared to simulating a small chunk of
+    photons, so the version is determined once per process and then reused.
+    If the caldb is not a git repository (e.g. a copy on a batch node without
+    git) the information is read from the stamp file written by
+    `write_git_stamp` instead.
+    '''
+    if not _git_info:
+        try:
+            githash = subprocess.check_output(["git", "describe", "--always"],
+                                              cwd=conf.caldb_inputdata)[:-1]
+            date = subprocess.check_output(['git', 'show', '-s', '--format=%ci',
+                                            githash],
+                                           cwd=conf.caldb_inputdata)
+        except (OSError, subprocess.CalledProcessError):
+            if os.path.exists(git_stamp_path()):
+                with open(git_stamp_path()) as f:
+                    githash, date = f.read().split('\n', 1)
+            else:
+                logging.warning('Cannot determine version of data files in {}.'.format(conf.caldb_inputdata))
+                githash, date = 'unknown', 'unknown'
+        _git_info['hash'] = githash
+        _git_info['date'] = date
+    return _git_info
+
+
+def write_git_stamp():
+    '''Save the version of the caldb-inputdata repository in a stamp file.
+
+    Run this before copying the caldb to a machine without git, so that
+    simulations there can still record the version of the input data.
+
+    Returns
+    -------
+    filename : string
+        Name of the stamp file.
+    '''
+    info = _git_provenance()
+    with open(git_stamp_path(), 'w') as f:
+        f.write('{}\n{}'.format(info['hash'], info['date']))
+    return git_stamp_path()
+
+
 def get_git_hash():
-    return subprocess.check_output(["git", "describe", "--always"],
-                                   cwd=conf.caldb_inputdata)[:-1]
+    return _git_provenance()['hash']
 
 
 def string_git_info():
-    githash = get_git_hash()
-    date = subprocess.check_output(['git', 'show', '-s', '--format=%ci',
-                                    githash],
-                                   cwd=conf.caldb_inputdata)
-    return 'hash: {} - commited on {}'.format(githash, date)
+    info = _git_provenance()
+    return 'hash: {} - commited on {}'.format(info['hash'], info['date'])
 
 
 def log_tab_metadata(dirname, filename, tab):
@@ -52,6 +112,206 @@ def log_tab_metadata(dirname, filename, tab):
                 logging.info('{}: {}'.format(k, tab.meta[k]))
 
 
+def cache_info():
+    '''Report usage of the in-process cache for caldb tables.
+
+    Returns
+    -------
+    info : dict
+        Number of cache ``hits`` and ``misses``, the current number of
+        tables in the cache (``size``) and the ``maxsize``.
+    '''
+    return {'hits': _cache_stats['hits'], 'misses': _cache_stats['misses'],
+            'size': len(_table_cache), 'maxsize': cache_maxsize}
+
+
+def clear_cache():
+    '''Remove all tables from the in-process cache and reset the counters.
+
+    Call this after the files in the caldb-inputdata repository changed
+    (e.g. after a ``git pull``) to force a re-read of the data and of the
+    git version of the repository.
+    '''
+    _table_cache.clear()
+    _cache_stats['hits'] = 0
+    _cache_stats['misses'] = 0
+    _compiled.clear()
+    _git_info.clear()
+
+
+def compiled_cache_path():
+    '''Location of the compiled caldb for the current ``caldb_inputdata``.
+
+    The file lives in ``conf.cache_dir``. Its name contains a hash of the
+    path to the caldb, such that caches for different copies of the
+    caldb-inputdata repository do not overwrite each other.
+    '''
+    caldb = os.path.abspath(os.path.expanduser(conf.caldb_inputdata))
+    key = hashlib.md5(caldb.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(conf.cache_dir, 'caldb-{}.npz'.format(key))
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def compile_caldb(filename=None):
+    '''Parse all ecsv files in the caldb and store them in a binary file.
+
+    Parsing ecsv files is slow compared to reading binary data. This function
+    reads every ".csv" file in ``conf.caldb_inputdata`` and writes all columns
+    (with units, formats and descriptions) and the table meta data into a
+    single numpy ".npz" file. `read_table` (and thus `load_number`,
+    `load_table` and `load_table2d`) transparently use that file when it
+    exists.
+
+    The modification time and size of each ecsv file are stored with
+    the data. If a file changes later (e.g. after a ``git pull`` in the caldb
+    repository), the compiled version of that file is ignored and the ecsv
+    file is parsed instead, until `compile_caldb` is run again.
+
+    Files that cannot be compiled (e.g. because they are not valid ecsv or
+    contain masked columns or meta data that cannot be represented in JSON)
+    are skipped with a warning and will always be read from the ecsv file.
+
+    Parameters
+    ----------
+    filename : string
+        Name of the output file. Default is `compiled_cache_path`.
+
+    Returns
+    -------
+    filename : string
+        Name of the file that was written.
+    '''
+    if filename is None:
+        filename = compiled_cache_path()
+    root = os.path.expanduser(conf.caldb_inputdata)
+    index = OrderedDict([('caldb_inputdata', conf.caldb_inputdata),
+                         ('githash', get_git_hash()),
+                         ('tables', OrderedDict())])
+    arrays = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for f in sorted(filenames):
+            if not f.endswith('.csv'):
+                continue
+            path = os.path.join(dirpath, f)
+            key = os.path.relpath(path, root)[:-4].replace(os.sep, '/')
+            try:
+                tab = Table.read(path, format='ascii.ecsv')
+                meta = json.loads(json.dumps(tab.meta),
+                                  object_pairs_hook=OrderedDict)
+            except Exception as e:
+                logging.warning('{} not compiled: {}'.format(key, e))
+                continue
+            if any(isinstance(c, MaskedColumn) for c in tab.columns.values()):
+                logging.warning('{} not compiled: masked columns'.format(key))
+                continue
+            columns = []
+            for col in tab.columns.values():
+                arrayname = 'c{}'.format(len(arrays))
+                arrays[arrayname] = np.asarray(col)
+                columns.append({'name': col.name, 'array': arrayname,
+                                'unit': None if col.unit is None else col.unit.to_string(),
+                                'description': col.description,
+                                'format': col.format})
+            index['tables'][key] = {'signature': _file_signature(path),
+                                    'columns': columns, 'meta': meta}
+    arrays['__index__'] = np.array(json.dumps(index))
+
+    outdir = os.path.dirname(filename)
+    if outdir and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    # Write to a temporary file first, so that processes reading the cache
+    # never see a partially written file.
+    tempname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tempname, 'wb') as fh:
+        np.savez(fh, **arrays)
+    os.rename(tempname, filename)
+    _compiled.clear()
+    logging.info('Compiled {} tables from {} into {}'.format(len(index['tables']),
+                                                             conf.caldb_inputdata,
+                                                             filename))
+    return filename
+
+
+def _read_compiled(path, dirname, filename):
+    '''Get a table from the compiled caldb.
+
+    Returns ``None`` if there is no compiled caldb, if the table is not in it,
+    or if the ecsv file changed after the caldb was compiled.
+    '''
+    if 'index' not in _compiled:
+        cachefile = compiled_cache_path()
+        if os.path.exists(cachefile):
+            arrays = np.load(cachefile)
+            _compiled['arrays'] = arrays
+            _compiled['index'] = json.loads(arrays['__index__'].item(),
+                                            object_pairs_hook=OrderedDict)
+        else:
+            _compiled['index'] = None
+    index = _compiled['index']
+    key = '{}/{}'.format(dirname, filename)
+    if (index is None) or (key not in index['tables']):
+        return None
+    entry = index['tables'][key]
+    if not os.path.exists(path) or (entry['signature'] != _file_signature(path)):
+        return None
+    tab = Table(meta=entry['meta'])
+    for col in entry['columns']:
+        tab.add_column(Column(_compiled['arrays'][col['array']],
+                              name=col['name'], unit=col['unit'],
+                              description=col['description'],
+                              format=col['format']))
+    return tab
+
+
+def read_table(dirname, filename):
+    '''Read an ecsv file from the caldb, parsing each file only once.
+
+    Parsed tables are kept in a cache (keyed by the full path of the file)
+    that holds at most ``cache_maxsize`` tables; the least recently used table
+    is dropped when that limit is exceeded. Metadata is logged only when a
+    file is actually read from disk. If a compiled caldb (see
+    `compile_caldb`) exists and is up to date for this file, the table is
+    taken from there instead of parsing the ecsv file.
+
+    Parameters
+    ----------
+    dirname : string
+        Name for the directory in the caldb-input file structure
+    filename : string
+        Name of data file (without the ".csv" part)
+
+    Returns
+    -------
+    tab : `astropy.table.Table`
+        The cached table. Treat it as read-only; `load_table` returns a copy
+        that can be modified.
+    '''
+    path = os.path.join(conf.caldb_inputdata, dirname, filename + '.csv')
+    with timeline.span('{}/{}'.format(dirname, filename), 'caldb') as args:
+        if path in _table_cache:
+            _cache_stats['hits'] += 1
+            tab = _table_cache.pop(path)
+            args['source'] = 'memory'
+        else:
+            _cache_stats['misses'] += 1
+            tab = _read_compiled(path, dirname, filename)
+            args['source'] = 'compiled'
+            if tab is None:
+                tab = Table.read(path, format='ascii.ecsv')
+                args['source'] = 'ecsv'
+            log_tab_metadata(dirname, filename, tab)
+    # Re-insert to mark this table as the most recently used one.
+    _table_cache[path] = tab
+    while len(_table_cache) > cache_maxsize:
+        _table_cache.popitem(last=False)
+    return tab
+
+
 def load_number(dirname, filename, valuename):
     '''Get a single number from an ecsv input file
 
@@ -70,9 +330,7 @@ def load_number(dirname, filename, valuename):
         If the unit of the column is set, returns a `astropy.units.Quantity`
         instance, otherwise a plain float.
     '''
-    tab = Table.read(os.path.join(conf.caldb_inputdata, dirname,
-                                  filename + '.csv'), format='ascii.ecsv')
-    log_tab_metadata(dirname, filename, tab)
+    tab = read_table(dirname, filename)
     if len(tab) != 1:
         raise DataFileFormatException('Table {} contains more than one row of data.'.format(filename))
     else:
@@ -96,10 +354,7 @@ def load_table(dirname, filename):
     -------
     val : `astropy.table.Table`
     '''
-    tab = Table.read(os.path.join(conf.caldb_inputdata, dirname,
-                                  filename + '.csv'), format='ascii.ecsv')
-    log_tab_metadata(dirname, filename, tab)
-    return (tab)
+    return read_table(dirname, filename).copy()
 
 
 def load_table2d(dirname, filename):
@@ -130,9 +385,7 @@ def load_table2d(dirname, filename):
     dat : np.array
         The remaining outputs are np.arrays of shape (len(x), len(y))
     '''
-    tab = Table.read(os.path.join(conf.caldb_inputdata, dirname,
-                                  filename + '.csv'), format='ascii.ecsv')
-    log_tab_metadata(dirname, filename, tab)
+    tab = read_table(dirname, filename).copy()
 
     x = tab.columns[0]
     y = tab.columns[1]
@@ -147,3 +400,16 @@ def load_table2d(dirname, filename):
     coldat = [tab[d].data.reshape(n_x, n_y) for d in tab.columns[2:]]
 
     return x, y, colnames, coldat
+
+
+def main():
+    '''Command line interface for `compile_caldb`.'''
+    parser = argparse.ArgumentParser(description='Compile the ecsv files in the ARCUS caldb into a binary cache for faster loading.')
+    parser.add_argument('filename', nargs='?', default=None,
+                        help='Output file (default: {})'.format(compiled_cache_path()))
+    args = parser.parse_args()
+    print(compile_caldb(args.filename))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+'''Measure time and throughput of every element of an instrument.
+
+`profile_instrument` wraps every element of an instrument (e.g.
+``arcus.arcus.arcus4``), including the elements of nested sequences and the
+children of `marxs.simulator.Parallel` containers, in a `ProfiledElement`.
+Each call records
+
+- the wall time (including the time spent in the children),
+- the number of photons going in and out and the number of those photons
+  with a probability > 0,
+- the change in the memory used by the photon table (in bytes) and the
+  increase of the peak memory of the process (in bytes).
+
+If `arcus.timeline.timeline` is recording, each call is also added to the
+timeline.
+
+The numbers are summed over all calls in a `Profile`, which can be turned
+into a table and which is attached to the meta data of the output photon
+list, so that the profile of a run is kept with its result::
+
+    from arcus import profiling
+    instrument = profiling.profile_instrument(arcus.arcus.arcus4)
+    photons = instrument(photons)
+    photons.meta['PROFILE']
+
+Some containers do not call their elements one by one, but find the element
+for each photon in a different way (e.g. `arcus.spo.IndexedSPOChannelMirror`).
+Those containers set ``profile_children = False`` and are profiled as a
+whole.
+'''
+import sys
+import copy
+import time
+from collections import OrderedDict
+from timeit import default_timer
+
+from astropy.table import Table
+from marxs.simulator import BaseContainer
+
+from .timeline import timeline
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def maxrss():
+    '''Peak memory use of this process in bytes (0 if not available).'''
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, OS X reports bytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def table_nbytes(photons):
+    '''Memory used by the data of all columns of a photon table.'''
+    return sum(photons[c].nbytes for c in photons.colnames)
+
+
+def n_live(photons):
+    '''Number of photons with a probability > 0.'''
+    if 'probability' not in photons.colnames:
+        return len(photons)
+    return int((photons['probability'] > 0).sum())
+
+
+class Profile(object):
+    '''Accumulate timing and throughput for a set of elements.
+
+    Elements are listed in the order in which they are registered, which
+    for `profile_instrument` is the order in the instrument, with every
+    container followed by its children.
+    '''
+    columns = ['element', 'calls', 'time', 'n_in', 'n_out',
+               'n_live_in', 'n_live_out', 'bytes_table', 'bytes_peak']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Set all counters to zero.'''
+        self.stats = OrderedDict()
+
+    def register(self, name):
+        '''Add an element with all counters at zero.'''
+        self.stats.setdefault(name, OrderedDict((c, 0) for c in self.columns[1:]))
+
+    def add(self, name, **values):
+        '''Add one call of an element.
+
+        Parameters
+        ----------
+        name : string
+            Name of the element.
+        values : dict
+            Numbers for the columns listed in `columns`, except ``calls``.
+        '''
+        self.register(name)
+        stats = self.stats[name]
+        stats['calls'] += 1
+        for k, v in values.items():
+            stats[k] += v
+
+    def table(self):
+        '''Profile as a table with one row per element.
+
+        Returns
+        -------
+        tab : `astropy.table.Table`
+            The ``time`` column is in seconds, the ``bytes_*`` columns in
+            bytes.
+        '''
+        rows = [[name] + list(s.values()) for name, s in self.stats.items()]
+        tab = Table(rows=rows if rows else None, names=self.columns,
+                    dtype=[str, int, float, int, int, int, int, int, int])
+        tab['time'].unit = 's'
+        tab['bytes_table'].unit = 'byte'
+        tab['bytes_peak'].unit = 'byte'
+        return tab
+
+
+class ProfiledElement(object):
+    '''Wrap an element and record every call in a `Profile`.
+
+    All attributes other than those listed here are taken from the wrapped
+    element.
+
+    Parameters
+    ----------
+    element : callable
+        Element of an instrument.
+    name : string
+        Name of the element in the profile.
+    profile : `Profile`
+    metakey : string or ``None``
+        If set, the table of ``profile`` is attached to the meta data of the
+        output photon list with this key after each call.
+    '''
+    def __init__(self, element, name, profile, metakey=None):
+        self.element = element
+        self.profile_name = name
+        self.profile = profile
+        self.metakey = metakey
+        profile.register(name)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself. Guard
+        # against recursion while ``element`` is not set yet (e.g. in copy).
+        if name == 'element':
+            raise AttributeError(name)
+        return getattr(self.element, name)
+
+    def __call__(self, photons, *args, **kwargs):
+        n_in = len(photons)
+        live_in = n_live(photons)
+        bytes_in = table_nbytes(photons)
+        rss_in = maxrss()
+        wall = time.time()
+        start = default_timer()
+        out = self.element(photons, *args, **kwargs)
+        duration = default_timer() - start
+        # Some functions change the photons in place and return nothing.
+        result = photons if out is None else out
+        values = {'n_in': n_in, 'n_out': len(result),
+                  'n_live_in': live_in, 'n_live_out': n_live(result),
+                  'bytes_table': table_nbytes(result) - bytes_in,
+                  'bytes_peak': maxrss() - rss_in}
+        self.profile.add(self.profile_name, time=duration, **values)
+        timeline.add(self.profile_name, 'element', wall, duration, **values)
+        if self.metakey is not None:
+            result.meta[self.metakey] = self.profile.table()
+        return out
+
+
+def element_label(element):
+    '''Short name of an element for the profile.
+
+    ARCUS elements are named as in `arcus.arcus.get`, other elements by
+    their ``name`` attribute, their function name or their class name.
+    '''
+    from . import arcus
+    for name in arcus.built():
+        if arcus.get(name) is element:
+            return name
+    name = getattr(element, 'name', None)
+    if isinstance(name, str):
+        return name
+    if hasattr(element, '__name__'):
+        return element.__name__
+    return element.__class__.__name__
+
+
+def _wrap(element, name, profile):
+    # Register before the children, so that the profile is listed in the
+    # order of the instrument.
+    profile.register(name)
+    if (isinstance(element, BaseContainer) and
+            getattr(element, 'profile_children', True)):
+        labels = [element_label(e) for e in element.elements]
+        duplicates = set(l for l in labels if labels.count(l) > 1)
+        count = {}
+        for i, label in enumerate(labels):
+            if label in duplicates:
+                count[label] = count.get(label, -1) + 1
+                labels[i] = '{}[{}]'.format(label, count[label])
+        # Copy instead of changing the container in place, because
+        # containers are shared between configurations.
+        element = copy.copy(element)
+        element.elements = [_wrap(e, name + '/' + label, profile)
+                            for e, label in zip(element.elements, labels)]
+    return ProfiledElement(element, name, profile)
+
+
+def profile_instrument(element, profile=None, name=None, metakey='PROFILE'):
+    '''Wrap all elements of an instrument to record a profile.
+
+    The input instrument is not changed; a copy of all containers is made.
+    Optical elements are shared with the input.
+
+    Parameters
+    ----------
+    element : callable
+        Instrument, e.g. ``arcus.arcus.arcus4``.
+    profile : `Profile` or ``None``
+        Profile to add the calls to. If ``None``, a new `Profile` is made.
+    name : string or ``None``
+        Name of the instrument in the profile. Names of all other elements
+        start with this name, e.g. ``'arcus4/mirror4/lens1'``. If ``None``,
+        the name is found with `element_label`.
+    metakey : string or ``None``
+        Key for the profile table in the meta data of the output photon list.
+        The table contains the sum of all calls so far. If ``None``, the
+        profile is not attached to the photons.
+
+    Returns
+    -------
+    instrument : `ProfiledElement`
+        Wrapped instrument. The profile is available as
+        ``instrument.profile``.
+    '''
+    if profile is None:
+        profile = Profile()
+    if name is None:
+        name = element_label(element)
+    wrapped = _wrap(element, name, profile)
+    wrapped.metakey = metakey
+    return wrapped
@@ -30,15 +30,52 @@ class InterpolateRalfTable(object):
     `scipy.interpolate.RectBivariateSpline` for interpolation in each 2-d slice
     (``order`` is an integer and not interpolated).
 
+    Evaluating one spline per order for every photon is slow. Optionally,
+    all splines can be evaluated once on a fine, regular (wavelength, blaze)
+    grid (set ``lookup_shape``). The probabilities for each photon are then
+    interpolated bilinearly in that grid for all orders at once. The error of
+    bilinear interpolation is bounded by
+    ``h_wave**2 / 8 * max|d2p/dwave2| + h_blaze**2 / 8 * max|d2p/dblaze2|``,
+    where ``h`` is the grid spacing, so it decreases quadratically with
+    the number of grid points. The largest deviation from the spline is
+    usually found in the center of a grid cell; it is measured for all cell
+    centers when the grid is set up and stored as ``lookup_accuracy``
+    (absolute difference in probability).
+    Outside of the range of the data table, the probabilities of the edge of
+    the table are used in both modes.
+
+    If only a few orders are of interest, set ``selected_orders``. Photons
+    are then diffracted into those orders only, with the relative
+    probabilities of the table, and the returned probability is the sum of
+    the probabilities of the selected orders. Thus, the sum of the
+    probabilities of all photons in a selected order (and thus the
+    effective area) is the same as without selection (within the Monte-Carlo
+    noise), but no photons are spent on orders that are discarded later.
+
     Parameters
     ----------
-    filename : string
-        path and name of data file
     k : int
         Degree of spline. See `scipy.interpolate.RectBivariateSpline`.
+    lookup_shape : tuple of two ints or ``None``
+        Number of (wavelength, blaze angle) points for the lookup grid.
+        If ``None`` (the default), the splines are evaluated for every photon.
+    selected_orders : list of int or ``None``
+        Orders that photons are diffracted into. ``None`` (the default)
+        selects all orders in the table.
+    '''
+
+    lookup_accuracy = None
+    '''Maximal difference between lookup grid and splines in the grid cell centers.'''
+
+    blocksize = 100000
+    '''Number of photons for which orders are drawn at the same time.
+
+    Memory use of the order selection is proportional to
+    ``blocksize * n_orders``, independent of the total number of photons.
     '''
 
-    def __init__(self, k=3):
+    def __init__(self, k=3, lookup_shape=None, selected_orders=None):
+        self.selected_orders = selected_orders
         wave, theta, names, orders = load_table2d('gratings', 'efficiency')
         theta = theta.to(u.rad)
         # Order is int, we will never interpolate about order,
@@ -46,6 +83,47 @@ class InterpolateRalfTable(object):
         # len(order) 2d interpolations
         self.orders = -np.array([int(n[1:]) for n in names])
         self.interpolators = [RectBivariateSpline(wave, theta, d, kx=k, ky=k) for d in orders]
+        if lookup_shape is None:
+            self.lookup_table = None
+        else:
+            self.lookup_wave = np.linspace(np.min(wave), np.max(wave), lookup_shape[0])
+            self.lookup_blaze = np.linspace(np.min(theta.value), np.max(theta.value),
+                                            lookup_shape[1])
+            self.lookup_table = self._eval_splines(self.lookup_wave, self.lookup_blaze)
+            # Compare to splines in the center of each cell
+            wmid = 0.5 * (self.lookup_wave[1:] + self.lookup_wave[:-1])
+            bmid = 0.5 * (self.lookup_blaze[1:] + self.lookup_blaze[:-1])
+            wmid, bmid = np.meshgrid(wmid, bmid, indexing='ij')
+            wmid = wmid.ravel()
+            bmid = bmid.ravel()
+            spline = np.array([interp.ev(wmid, bmid) for interp in self.interpolators])
+            self.lookup_accuracy = np.max(np.abs(self._lookup(wmid, bmid) - spline))
+
+    def _eval_splines(self, wave, blaze):
+        '''Evaluate all splines on a grid.
+
+        Returns
+        -------
+        table : np.array of shape (len(wave), len(blaze), n_orders)
+        '''
+        return np.dstack([interp(wave, blaze) for interp in self.interpolators])
+
+    def _lookup(self, wave, blaze):
+        '''Bilinear interpolation in the lookup grid for all orders.'''
+        def index(val, grid):
+            val = np.clip(val, grid[0], grid[-1])
+            frac = (val - grid[0]) / (grid[1] - grid[0])
+            ind = np.minimum(frac.astype(int), len(grid) - 2)
+            return ind, (frac - ind)[:, None]
+
+        iw, fw = index(wave, self.lookup_wave)
+        ib, fb = index(blaze, self.lookup_blaze)
+        t = self.lookup_table
+        interp = (t[iw, ib] * ((1 - fw) * (1 - fb)) +
+                  t[iw + 1, ib] * (fw * (1 - fb)) +
+                  t[iw, ib + 1] * ((1 - fw) * fb) +
+                  t[iw + 1, ib + 1] * (fw * fb))
+        return interp.T
 
     def probabilities(self, energies, pol, blaze):
         '''Obtain the probabilties for photons to go into a particular order.
@@ -75,19 +153,46 @@ class InterpolateRalfTable(object):
         # convert energy in keV to wavelength in nm
         # (nm is the unit of the input table)
         wave = (energies * u.keV).to(u.nm, equivalencies=u.spectral()).value
+        if self.lookup_table is not None:
+            return self.orders, self._lookup(wave, blaze)
         interpprobs = np.empty((len(self.orders), len(energies)))
         for i, interp in enumerate(self.interpolators):
             interpprobs[i, :] = interp.ev(wave, blaze)
         return self.orders, interpprobs
 
-    def __call__(self, energies, pol, blaze):
-        orders, interpprobs = self.probabilities(energies, pol, blaze)
-        totalprob = np.sum(interpprobs, axis=0)
-        # Cumulative probability for orders, normalized to 1.
-        cumprob = np.cumsum(interpprobs, axis=0) / totalprob
-        ind_orders = np.argmax(cumprob > np.random.rand(len(energies)), axis=0)
+    def order_mask(self):
+        '''Boolean array that marks the selected orders in `orders`.'''
+        if self.selected_orders is None:
+            return np.ones(len(self.orders), dtype=bool)
+        mask = np.in1d(self.orders, self.selected_orders)
+        if not mask.any():
+            raise ValueError('None of the selected orders {} is in the table.'.format(self.selected_orders))
+        return mask
 
-        return orders[ind_orders], totalprob
+    def __call__(self, energies, pol, blaze):
+        n = len(energies)
+        totalprob = np.empty(n)
+        ind_orders = np.empty(n, dtype=int)
+        mask = self.order_mask()
+        # Work in blocks of photons to limit the size of the
+        # (n_orders, n_photons) arrays. Random numbers are drawn in the same
+        # sequence as for a single block, so the result does not depend on
+        # the block size.
+        for start in range(0, n, self.blocksize):
+            sl = slice(start, start + self.blocksize)
+            orders, interpprobs = self.probabilities(energies[sl], pol[sl], blaze[sl])
+            if not mask.all():
+                interpprobs[~mask, :] = 0.
+            # Cumulative probability for orders, normalized to 1.
+            cumprob = np.cumsum(interpprobs, axis=0, out=interpprobs)
+            totalprob[sl] = cumprob[-1, :]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cumprob /= totalprob[sl]
+            ind_orders[sl] = np.argmax(cumprob > np.random.rand(cumprob.shape[1]), axis=0)
+            # Photons with probability 0 are put in a selected order, too.
+            ind_orders[sl][totalprob[sl] == 0] = np.argmax(mask)
+
+        return self.orders[ind_orders], totalprob
 
 
 class RalfQualityFactor(SimulationSequenceElement):
@@ -120,4 +225,5 @@ def catsupportbars(photons):
 
 
 catsupport = GlobalEnergyFilter(filterfunc=lambda e: load_number('gratings', 'L1support', 'transmission') *
-                                load_number('gratings', 'L2support', 'transmission'))
+                                load_number('gratings', 'L2support', 'transmission'),
+                                name='CAT support')
@@ -0,0 +1,375 @@
+'''Run simulations in chunks of photons.
+
+Passing a single photon list through an instrument needs memory in
+proportion to the number of photons. For large simulations, the functions
+in this module generate and trace photons in chunks of limited size and hand
+each traced chunk to a "sink", e.g. to write it to disk or to keep only
+the columns needed for the analysis, so that the peak memory does not
+depend on the total number of photons.
+
+The amount of photons is set by the exposure time, in the same way as for
+``source.generate_photons``; for a source with a constant ``flux`` of one
+photon per second (and per unit area), the exposure time in seconds is just
+the number of photons.
+
+Runs can be distributed over several processes with `run_parallel`. Every
+chunk draws its random numbers from its own stream, seeded from a master
+seed and the number of the chunk, so that the result of a simulation with a
+given seed does not depend on the number of processes (or on whether it is
+run in parallel at all).
+
+If `arcus.timeline.timeline` is recording, every chunk and every call of the
+sink is added to the timeline and the instrument is wrapped with
+`arcus.profiling.profile_instrument`, so that each element call is recorded,
+too. For `run_parallel`, the events recorded in the worker processes are
+collected in the timeline of the main process.
+'''
+import multiprocessing
+from collections import deque
+
+import numpy as np
+from astropy.table import vstack
+from marxs.simulator import KeepCol
+
+from .timeline import timeline
+from .profiling import ProfiledElement, profile_instrument
+
+
+def clear_keepcol(element):
+    '''Remove recorded data from all `marxs.simulator.KeepCol` objects.
+
+    `marxs.simulator.KeepCol` objects in the ``preprocess_steps`` and
+    ``postprocess_steps`` of an instrument record a column after every
+    step. When the same instrument is used for many chunks, this data
+    needs to be discarded between chunks, otherwise memory usage grows
+    with every chunk.
+
+    Parameters
+    ----------
+    element : `marxs.simulator.BaseContainer` or other sequence element
+        Containers are searched recursively.
+    '''
+    for step in (getattr(element, 'preprocess_steps', []) +
+                 getattr(element, 'postprocess_steps', [])):
+        if isinstance(step, KeepCol):
+            step.data = []
+    for elem in getattr(element, 'elements', []):
+        clear_keepcol(elem)
+
+
+def get_instrument(instrument):
+    '''Return an instrument, looking it up by name if necessary.
+
+    Parameters
+    ----------
+    instrument : callable or string
+        Instrument or name of an ARCUS configuration (see `arcus.arcus.get`).
+    '''
+    if callable(instrument):
+        return instrument
+    from . import arcus
+    return arcus.get(instrument)
+
+
+def _profile_if_recording(instrument):
+    '''Wrap the instrument to record element calls in the timeline.'''
+    if timeline.recording and not isinstance(instrument, ProfiledElement):
+        return profile_instrument(instrument, metakey=None)
+    return instrument
+
+
+def seed_chunk(seed, chunk):
+    '''Seed the random number generator for one chunk.
+
+    All random numbers in marxs and arcus are drawn from the global numpy
+    random number generator. This seeds it with a combination of a master
+    seed and the number of the chunk, such that each chunk has an
+    independent stream of random numbers that does not depend on which
+    process simulates the chunk.
+
+    Parameters
+    ----------
+    seed : int or None
+        Master seed. If ``None``, the random number generator is not seeded.
+    chunk : int
+        Number of the chunk.
+    '''
+    if seed is not None:
+        np.random.seed([seed, chunk])
+
+
+def trace_chunk(source, pointing, instrument, start, exposuretime):
+    '''Generate photons for one time interval and pass them through an instrument.
+
+    Parameters
+    ----------
+    source : `marxs.source.Source`
+        Source of photons.
+    pointing : `marxs.source.PointingModel`
+        Pointing model that transforms the photons into the instrument system.
+    instrument : callable
+        Instrument, e.g. ``arcus.arcus.arcus4``.
+    start : float
+        Time (in seconds) of the start of this chunk. The photon times are
+        shifted by this amount, so that times are continuous over all chunks.
+    exposuretime : float
+        Exposure time for this chunk.
+
+    Returns
+    -------
+    photons : `astropy.table.Table`
+        Traced photons.
+    '''
+    photons = source.generate_photons(exposuretime)
+    photons['time'] += start
+    photons = pointing(photons)
+    photons = instrument(photons)
+    return photons
+
+
+def chunk_intervals(exposuretime, chunksize):
+    '''Split an exposure time into intervals of at most ``chunksize``.
+
+    Returns
+    -------
+    intervals : list of tuples
+        ``(start, length)`` for each chunk.
+    '''
+    if chunksize <= 0:
+        raise ValueError('chunksize must be positive.')
+    starts = np.arange(0, exposuretime, chunksize)
+    return [(start, min(chunksize, exposuretime - start)) for start in starts]
+
+
+def iter_chunks(source, pointing, instrument, exposuretime, chunksize,
+                seed=None):
+    '''Generate and trace photons chunk by chunk.
+
+    Parameters
+    ----------
+    source : `marxs.source.Source`
+        Source of photons.
+    pointing : `marxs.source.PointingModel`
+        Pointing model that transforms the photons into the instrument system.
+    instrument : callable or string
+        Instrument, e.g. ``arcus.arcus.arcus4``, or the name of an ARCUS
+        configuration, e.g. ``'arcus4'``.
+    exposuretime : float
+        Total exposure time in seconds.
+    chunksize : float
+        Exposure time for each chunk. This sets the number of photons held in
+        memory at any one time.
+    seed : int or None
+        Master seed for the random numbers, see `seed_chunk`.
+
+    Yields
+    ------
+    photons : `astropy.table.Table`
+        Traced photons for one chunk. The meta data contains the number of
+        the chunk as ``CHUNK``.
+    '''
+    instrument = _profile_if_recording(get_instrument(instrument))
+    for i, (start, length) in enumerate(chunk_intervals(exposuretime, chunksize)):
+        with timeline.span('chunk {}'.format(i), 'chunk', chunk=i):
+            clear_keepcol(instrument)
+            seed_chunk(seed, i)
+            photons = trace_chunk(source, pointing, instrument, start, length)
+        photons.meta['CHUNK'] = (i, 'Number of simulation chunk')
+        yield photons
+    clear_keepcol(instrument)
+
+
+def run_chunked(source, pointing, instrument, exposuretime, chunksize, sink,
+                seed=None):
+    '''Run a simulation in chunks and pass each chunk to a sink.
+
+    Parameters
+    ----------
+    source : `marxs.source.Source`
+        Source of photons.
+    pointing : `marxs.source.PointingModel`
+        Pointing model that transforms the photons into the instrument system.
+    instrument : callable or string
+        Instrument, e.g. ``arcus.arcus.arcus4``, or the name of an ARCUS
+        configuration, e.g. ``'arcus4'``.
+    exposuretime : float
+        Total exposure time in seconds.
+    chunksize : float
+        Exposure time for each chunk.
+    sink : callable
+        Called with the photon table of every chunk, e.g. `CollectChunks` or
+        `WriteChunks`.
+    seed : int or None
+        Master seed for the random numbers, see `seed_chunk`.
+
+    Returns
+    -------
+    sink : callable
+        The sink that was passed in.
+    '''
+    for photons in iter_chunks(source, pointing, instrument,
+                               exposuretime, chunksize, seed=seed):
+        with timeline.span('sink', 'sink', chunk=photons.meta['CHUNK'][0]):
+            sink(photons)
+    return sink
+
+
+_worker = {}
+
+
+def _init_worker(source, pointing, instrument, recording):
+    # Forked workers start with a copy of the events of the main process.
+    # Those are already in the main timeline and must not be sent back.
+    timeline.clear()
+    if recording:
+        timeline.start()
+        timeline.label_process('worker {}'.format(multiprocessing.current_process().name))
+    _worker['source'] = source
+    _worker['pointing'] = pointing
+    _worker['instrument'] = _profile_if_recording(get_instrument(instrument))
+
+
+def _trace_task(task):
+    i, start, length, seed = task
+    instrument = _worker['instrument']
+    with timeline.span('chunk {}'.format(i), 'chunk', chunk=i):
+        clear_keepcol(instrument)
+        seed_chunk(seed, i)
+        photons = trace_chunk(_worker['source'], _worker['pointing'],
+                              instrument, start, length)
+        photons.meta['CHUNK'] = (i, 'Number of simulation chunk')
+        clear_keepcol(instrument)
+    # Events (including those from setting up the worker) are sent back
+    # with the photons.
+    return photons, timeline.pop_events()
+
+
+def run_parallel(source, pointing, instrument, exposuretime, chunksize, sink,
+                 seed=None, processes=None, max_pending=None):
+    '''Run a simulation in chunks distributed over several processes.
+
+    Each worker process sets up the instrument once and then traces chunks
+    of photons. The traced chunks are passed to the ``sink`` in the main
+    process in the order of the chunks, so the output is the same as for
+    `run_chunked` with the same ``seed``, independent of the number of
+    processes.
+
+    Parameters
+    ----------
+    source : `marxs.source.Source`
+        Source of photons.
+    pointing : `marxs.source.PointingModel`
+        Pointing model that transforms the photons into the instrument system.
+    instrument : callable or string
+        Instrument or the name of an ARCUS configuration, e.g. ``'arcus4'``.
+        Passing the name means that each worker builds only that
+        configuration on first use.
+    exposuretime : float
+        Total exposure time in seconds.
+    chunksize : float
+        Exposure time for each chunk.
+    sink : callable
+        Called with the photon table of every chunk.
+    seed : int or None
+        Master seed for the random numbers, see `seed_chunk`. If ``None``,
+        a master seed is drawn from the random number generator of the main
+        process. Otherwise, all worker processes would start from the same
+        copy of its state and return the same photons for different chunks.
+    processes : int or None
+        Number of worker processes. Default is the number of CPUs.
+    max_pending : int or None
+        Maximal number of chunks that are traced or waiting for the sink at
+        any time. Traced chunks are held in memory in the main process until
+        the sink has processed all earlier chunks, so this limits the memory
+        used when the sink is slower than the workers. Default is twice the
+        number of processes.
+
+    Returns
+    -------
+    sink : callable
+        The sink that was passed in.
+    '''
+    if seed is None:
+        seed = np.random.randint(2**31)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * processes
+    tasks = deque((i, start, length, seed) for i, (start, length)
+                  in enumerate(chunk_intervals(exposuretime, chunksize)))
+    n_chunks = len(tasks)
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(source, pointing, instrument,
+                                          timeline.recording))
+    pending = deque()
+    finished = False
+    try:
+        for i in range(n_chunks):
+            while tasks and len(pending) < max_pending:
+                pending.append(pool.apply_async(_trace_task, (tasks.popleft(), )))
+            # Time spent here is time that the main process waits for
+            # the workers.
+            with timeline.span('wait', 'run', chunk=i):
+                photons, events = pending.popleft().get()
+            timeline.events.extend(events)
+            with timeline.span('sink', 'sink', chunk=i):
+                sink(photons)
+        finished = True
+    finally:
+        # If a worker or the sink failed, do not trace the remaining chunks.
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+    return sink
+
+
+class CollectChunks(object):
+    '''Keep selected columns of all chunks in memory.
+
+    Parameters
+    ----------
+    columns : list of strings or ``None``
+        Names of columns to keep. ``None`` keeps all columns.
+    only_detected : bool
+        If ``True``, only photons with a probability > 0 are kept.
+    '''
+    def __init__(self, columns=None, only_detected=False):
+        self.columns = columns
+        self.only_detected = only_detected
+        self.chunks = []
+
+    def __call__(self, photons):
+        if self.only_detected:
+            photons = photons[photons['probability'] > 0]
+        if self.columns is not None:
+            photons = photons[self.columns]
+        self.chunks.append(photons)
+
+    @property
+    def photons(self):
+        '''All collected photons in one table.'''
+        return vstack(self.chunks, metadata_conflicts='silent')
+
+
+class WriteChunks(object):
+    '''Write each chunk to a separate file.
+
+    Parameters
+    ----------
+    filename : string
+        Template for the file names. It is formatted with the number of the
+        chunk, e.g. ``'sim_{:04d}.fits'``.
+    kwargs : dict
+        Passed on to `astropy.table.Table.write`.
+    '''
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.kwargs = kwargs
+        self.files = []
+
+    def __call__(self, photons):
+        filename = self.filename.format(len(self.files))
+        photons.write(filename, **self.kwargs)
+        self.files.append(filename)
@@ -0,0 +1,216 @@
+'''Stratified and quasi-random sampling of positions in the aperture.
+
+The apertures in marxs draw the position of every photon independently from
+``np.random``, so that quantities such as the effective area in a given
+order converge only as 1/sqrt(N). The apertures in this module can instead
+distribute photons more evenly over the aperture:
+
+- ``'random'``: Independent random positions, exactly as in marxs.
+- ``'stratified'``: Every sub-aperture (e.g. every SPO of a petal) receives
+  its expected number of photons (rounded up or down) instead of a
+  multinomial random number. Within each rectangle, positions are drawn
+  as a Latin hypercube, i.e. the range in y and in z is divided into N
+  strata each, and each stratum contains exactly one photon.
+- ``'sobol'``: As ``'stratified'``, but positions within each rectangle are
+  taken from a two-dimensional Sobol sequence. The sequence is scrambled
+  with a random linear matrix scramble and a random digital shift, so that
+  results for different random seeds are independent.
+
+In all cases, every point in the aperture has the same probability to be
+chosen, so results are unbiased. The photon list has the same columns as
+for the marxs apertures.
+'''
+import numpy as np
+from astropy import table
+from astropy.utils.metadata import enable_merge_strategies
+from marxs.optics.aperture import RectangleAperture, MultiAperture
+from marxs import utils
+
+methods = ['random', 'stratified', 'sobol']
+'''Names of the available sampling methods.'''
+
+_sobol_bits = 32
+
+
+def _sobol_directions():
+    # Direction numbers for the first two dimensions of the Sobol sequence.
+    # The first dimension is the van der Corput sequence in base 2, the
+    # second one uses the primitive polynomial x + 1.
+    v = np.zeros((2, _sobol_bits), dtype=np.uint64)
+    v[0, :] = 2**(_sobol_bits - 1 - np.arange(_sobol_bits))
+    v[1, 0] = 2**(_sobol_bits - 1)
+    for k in range(1, _sobol_bits):
+        v[1, k] = v[1, k - 1] ^ (v[1, k - 1] >> np.uint64(1))
+    return v
+
+
+_sobol_v = _sobol_directions()
+
+
+def _scramble_directions(v):
+    # Linear matrix scrambling: Multiply the generator matrix of each
+    # dimension by a random lower triangular binary matrix with ones on
+    # the diagonal (bits are counted from the most significant one).
+    bits = (v[:, :, None] >> np.uint64(_sobol_bits - 1 - np.arange(_sobol_bits))) & np.uint64(1)
+    scrambled = np.zeros_like(v)
+    for d in range(v.shape[0]):
+        lower = np.tril(np.random.randint(0, 2, size=(_sobol_bits, _sobol_bits)), -1)
+        lower += np.eye(_sobol_bits, dtype=lower.dtype)
+        newbits = np.dot(bits[d].astype(int), lower.T) % 2
+        scrambled[d] = np.dot(newbits, 2**(_sobol_bits - 1 - np.arange(_sobol_bits))).astype(np.uint64)
+    return scrambled
+
+
+def sobol(n, scramble=True):
+    '''Points of the two-dimensional Sobol sequence.
+
+    Parameters
+    ----------
+    n : int
+        Number of points.
+    scramble : bool
+        If ``True``, the points are scrambled with a random linear matrix
+        scramble and a random digital shift (drawn from ``np.random``). The
+        scrambled points still have the low discrepancy of the Sobol
+        sequence, but each point is uniformly distributed in the unit
+        square.
+
+    Returns
+    -------
+    points : np.array of shape (n, 2)
+        Points in the unit square [0, 1).
+    '''
+    if n >= 2**_sobol_bits:
+        raise ValueError('Sobol sequence is limited to 2**{} points.'.format(_sobol_bits))
+    v = _scramble_directions(_sobol_v) if scramble else _sobol_v
+    i = np.arange(n, dtype=np.uint64)
+    gray = i ^ (i >> np.uint64(1))
+    x = np.zeros((n, 2), dtype=np.uint64)
+    for k in range(int(n).bit_length()):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        x[bit, :] ^= v[:, k]
+    if scramble:
+        shift = np.random.randint(0, 2**16, size=(2, 2)).astype(np.uint64)
+        x ^= (shift[:, 0] << np.uint64(16)) | shift[:, 1]
+    return x / float(2**_sobol_bits)
+
+
+def stratified(n):
+    '''One random number in each of ``n`` equal intervals of [0, 1).
+
+    Parameters
+    ----------
+    n : int
+        Number of points.
+
+    Returns
+    -------
+    x : np.array of shape (n, )
+        The numbers are in random order.
+    '''
+    return np.random.permutation((np.arange(n) + np.random.rand(n)) / n)
+
+
+def uniform_2d(n, method):
+    '''Points in the unit square, distributed with the given method.
+
+    Parameters
+    ----------
+    n : int
+        Number of points.
+    method : string
+        One of `methods`.
+
+    Returns
+    -------
+    points : np.array of shape (n, 2)
+    '''
+    if method == 'random':
+        return np.random.random((n, 2))
+    elif method == 'stratified':
+        return np.vstack([stratified(n), stratified(n)]).T
+    elif method == 'sobol':
+        return sobol(n)
+    else:
+        raise ValueError('Unknown sampling method "{}". Use one of {}.'.format(method, methods))
+
+
+class SampledRectangleAperture(RectangleAperture):
+    '''Rectangular aperture with a choice of sampling method.
+
+    Parameters
+    ----------
+    sampling : string
+        One of `methods`. The default ``'random'`` gives the same photons as
+        `marxs.optics.RectangleAperture`.
+    '''
+    def __init__(self, **kwargs):
+        self.sampling = kwargs.pop('sampling', 'random')
+        super(SampledRectangleAperture, self).__init__(**kwargs)
+
+    def generate_local_xy(self, n):
+        if self.sampling == 'random':
+            return super(SampledRectangleAperture, self).generate_local_xy(n)
+        xy = 2. * uniform_2d(n, self.sampling) - 1.
+        return xy[:, 0], xy[:, 1]
+
+
+class SampledMultiAperture(MultiAperture):
+    '''Group of apertures with a choice of sampling method.
+
+    For ``sampling='random'``, photons are assigned to the apertures at
+    random, as in `marxs.optics.MultiAperture`. For all other methods,
+    the number of photons in each aperture is its expected number, rounded
+    up or down. The sampling method of the grouped apertures is not changed
+    by this class, use `set_sampling` to change all of them together.
+
+    Parameters
+    ----------
+    sampling : string
+        One of `methods`.
+    '''
+    def __init__(self, **kwargs):
+        self.sampling = kwargs.pop('sampling', 'random')
+        super(SampledMultiAperture, self).__init__(**kwargs)
+
+    def __call__(self, photons):
+        if self.sampling == 'random':
+            return super(SampledMultiAperture, self).__call__(photons)
+        if self.sampling not in methods:
+            raise ValueError('Unknown sampling method "{}". Use one of {}.'.format(self.sampling, methods))
+        areas = np.array([e.area.to(self.area.unit).value for e in self.elements])
+        aperid = np.digitize(stratified(len(photons)),
+                             np.cumsum(areas) / areas.sum())
+
+        if self.id_col is not None:
+            photons[self.id_col] = aperid
+        outs = []
+        for i, elem in enumerate(self.elements):
+            thisphot = photons[aperid == i]
+            for p in self.preprocess_steps:
+                p(thisphot)
+            thisphot = elem(thisphot)
+            for p in self.postprocess_steps:
+                p(thisphot)
+            outs.append(thisphot)
+        with enable_merge_strategies(utils.MergeIdentical):
+            photons = table.vstack(outs)
+
+        return photons
+
+
+def set_sampling(aperture, method):
+    '''Set the sampling method of an aperture and all apertures it groups.
+
+    Parameters
+    ----------
+    aperture : `SampledRectangleAperture` or `SampledMultiAperture`
+        Aperture, e.g. ``arcus.arcus.aper4``.
+    method : string
+        One of `methods`.
+    '''
+    if method not in methods:
+        raise ValueError('Unknown sampling method "{}". Use one of {}.'.format(method, methods))
+    aperture.sampling = method
+    for e in getattr(aperture, 'elements', []):
+        set_sampling(e, method)
@@ -0,0 +1,142 @@
+'''Spatial index to find which of many flat elements a photon hits.
+
+A `marxs.simulator.Parallel` container tests every photon against every
+element, so the cost of a container with many elements grows with the
+number of elements. If all elements lie in (or close to) a common plane, the
+photons can instead be projected into that plane and looked up in a
+uniform grid, where every grid cell knows which elements overlap it. Only
+those few candidates need to be tested exactly.
+'''
+import numpy as np
+
+
+class RectangleIndex(object):
+    '''Uniform grid index for rectangles in a plane.
+
+    Parameters
+    ----------
+    center : np.array of shape (n, 2)
+        Centers of the rectangles.
+    e_y, e_z : np.array of shape (n, 2)
+        Unit vectors along the two sides of each rectangle.
+    half_y, half_z : np.array of shape (n, )
+        Half-length of the sides of each rectangle along ``e_y`` and ``e_z``.
+    cellsize : float or ``None``
+        Size of a grid cell. If ``None``, the median size of the rectangles
+        is used, so that each cell overlaps only a few rectangles.
+    margin : float or np.array of shape (n, )
+        Each rectangle is listed as candidate for all grid cells within
+        ``margin`` of its edges. This allows for points that are only
+        approximately in the plane of the rectangles, see `candidates`.
+    '''
+    def __init__(self, center, e_y, e_z, half_y, half_z, cellsize=None,
+                 margin=0.):
+        self.center = np.asanyarray(center, dtype=float)
+        self.e_y = np.asanyarray(e_y, dtype=float)
+        self.e_z = np.asanyarray(e_z, dtype=float)
+        self.half_y = np.asanyarray(half_y, dtype=float)
+        self.half_z = np.asanyarray(half_z, dtype=float)
+        # Axis aligned bounding box of each rectangle, padded a little so
+        # that points on the edge are not lost to rounding errors.
+        extent = (np.abs(self.e_y) * self.half_y[:, None] +
+                  np.abs(self.e_z) * self.half_z[:, None]) * (1 + 1e-9)
+        if cellsize is None:
+            cellsize = np.median(2 * extent)
+        extent = extent + np.asanyarray(margin)[..., None]
+        bbox_min = self.center - extent
+        bbox_max = self.center + extent
+        self.cellsize = cellsize
+        self.origin = bbox_min.min(axis=0)
+        self.shape = np.floor((bbox_max.max(axis=0) - self.origin) /
+                              cellsize).astype(int) + 1
+
+        cells = [[] for i in range(np.prod(self.shape))]
+        cmin = np.floor((bbox_min - self.origin) / cellsize).astype(int)
+        cmax = np.floor((bbox_max - self.origin) / cellsize).astype(int)
+        for i in range(len(self.center)):
+            for ix in range(cmin[i, 0], cmax[i, 0] + 1):
+                for iy in range(cmin[i, 1], cmax[i, 1] + 1):
+                    cells[ix * self.shape[1] + iy].append(i)
+        self.max_candidates = max(len(c) for c in cells)
+        self.cells = -np.ones((len(cells), self.max_candidates), dtype=int)
+        for i, c in enumerate(cells):
+            self.cells[i, :len(c)] = c
+
+    def candidates(self, points):
+        '''Candidate rectangles for each point.
+
+        Parameters
+        ----------
+        points : np.array of shape (N, 2)
+
+        Returns
+        -------
+        candidates : np.array of shape (N, max_candidates)
+            Index numbers of the rectangles that overlap the grid cell of
+            each point (including their ``margin``), padded with -1.
+        '''
+        ind = np.floor((points - self.origin) / self.cellsize)
+        with np.errstate(invalid='ignore'):
+            inside = np.all((ind >= 0) & (ind < self.shape), axis=1)
+        ind[~inside, :] = 0
+        ind = ind.astype(int)
+        cand = self.cells[ind[:, 0] * self.shape[1] + ind[:, 1], :]
+        cand[~inside, :] = -1
+        return cand
+
+    def query_all(self, points):
+        '''Find all rectangles that contain each point.
+
+        Parameters
+        ----------
+        points : np.array of shape (N, 2)
+
+        Returns
+        -------
+        rect, point : np.array of shape (M, )
+            Index numbers of the rectangle and the point for each of the M
+            pairs where a rectangle contains a point, sorted by point and
+            then by rectangle.
+        coos : np.array of shape (M, 2)
+            Coordinates of the point along ``e_y`` and ``e_z`` relative to
+            the center of the rectangle.
+        '''
+        cand = self.candidates(points)
+        point, k = (cand >= 0).nonzero()
+        rect = cand[point, k]
+        d = points[point] - self.center[rect]
+        ey = np.sum(d * self.e_y[rect], axis=1)
+        ez = np.sum(d * self.e_z[rect], axis=1)
+        hit = (np.abs(ey) <= self.half_y[rect]) & (np.abs(ez) <= self.half_z[rect])
+        return rect[hit], point[hit], np.vstack([ey[hit], ez[hit]]).T
+
+    def query(self, points):
+        '''Find the rectangle that contains each point.
+
+        If rectangles overlap, the point is assigned to the one with the
+        lowest index.
+
+        Parameters
+        ----------
+        points : np.array of shape (N, 2)
+
+        Returns
+        -------
+        index : np.array of shape (N, )
+            Index number of the rectangle, -1 if the point is not in any
+            rectangle.
+        coos : np.array of shape (N, 2)
+            Coordinates of each point along ``e_y`` and ``e_z`` relative to
+            the center of its rectangle, ``np.nan`` if the point is not in
+            any rectangle.
+        '''
+        rect, point, hitcoos = self.query_all(points)
+        # Pairs are sorted by point and rectangle, so the first pair for each
+        # point is the one with the lowest rectangle index.
+        point, first = np.unique(point, return_index=True)
+        index = -np.ones(len(points), dtype=int)
+        index[point] = rect[first]
+        coos = np.empty((len(points), 2))
+        coos[:] = np.nan
+        coos[point, :] = hitcoos[first, :]
+        return index, coos
@@ -4,13 +4,15 @@ from transforms3d.affines import compose
 import astropy.units as u
 from scipy.interpolate import interp1d
 
-from marxs.optics.aperture import RectangleAperture, MultiAperture
 from marxs.optics import PerfectLens, GlobalEnergyFilter
 from marxs.simulator import Parallel
+from marxs.base import _parse_position_keywords
 from marxs.math.utils import e2h, h2e, norm_vector
 from marxs.math.polarization import parallel_transport
 
 from .load_csv import load_table, load_number
+from .spatialindex import RectangleIndex
+from .sampling import SampledRectangleAperture, SampledMultiAperture
 
 inplanescatter = 10. / 2.3545 / 3600 / 180. * np.pi
 perpplanescatter = 1.5 / 2.345 / 3600. / 180. * np.pi
@@ -31,6 +33,39 @@ for row, ang in zip(spogeom, u.Quantity(spogeom['angle']).to(u.rad).value):
                               row['depth'] / 2.]))
 
 
+def footprint_index(pos4d, elements):
+    '''Set up a `arcus.spatialindex.RectangleIndex` for flat elements.
+
+    Parameters
+    ----------
+    pos4d : np.array of shape (4, 4)
+        Position of the container. The index is set up in the yz plane of
+        this coordinate system.
+    elements : list
+        Flat elements (e.g. SPOs), which have a ``pos4d`` attribute.
+
+    Returns
+    -------
+    index : `arcus.spatialindex.RectangleIndex` or ``None``
+        ``None`` if the elements are not all in the yz plane of ``pos4d``.
+    '''
+    inv = np.linalg.inv(pos4d)
+    local = np.array([np.dot(inv, e.pos4d) for e in elements])
+    v_y = local[:, :3, 1]
+    v_z = local[:, :3, 2]
+    scale = np.linalg.norm(local[:, :3, :3], axis=(1, 2))
+    if not (np.allclose(local[:, 0, 3] / scale, 0) and
+            np.allclose(v_y[:, 0] / scale, 0) and
+            np.allclose(v_z[:, 0] / scale, 0)):
+        return None
+    half_y = np.linalg.norm(v_y, axis=1)
+    half_z = np.linalg.norm(v_z, axis=1)
+    return RectangleIndex(local[:, 1:3, 3],
+                          v_y[:, 1:] / half_y[:, None],
+                          v_z[:, 1:] / half_z[:, None],
+                          half_y, half_z)
+
+
 class PerfectLensSegment(PerfectLens):
     def __init__(self, **kwargs):
         self.d_center_optax = kwargs.pop('d_center_optical_axis')
@@ -47,6 +82,49 @@ class PerfectLensSegment(PerfectLens):
         return {'dir': dir, 'polarization': pol}
 
 
+class PerfectLensSegmentKernel(object):
+    '''Focus photons for many `PerfectLensSegment` elements at once.
+
+    The geometry of all segments is stored in arrays, so that the new
+    direction and polarization of all photons can be calculated in a single
+    pass, given the index number of the segment that each photon hits.
+    This gives the same result as `PerfectLensSegment.specific_process_photons`.
+
+    Parameters
+    ----------
+    elements : list of `PerfectLensSegment`
+    '''
+    def __init__(self, elements):
+        self.center = np.array([h2e(e.geometry('center')) for e in elements])
+        self.e_z = np.array([h2e(e.geometry('e_z')) for e in elements])
+        self.d_center_optax = np.array([e.d_center_optax for e in elements])
+        self.focallength = np.array([e.focallength for e in elements])
+        self.id_num = np.array([e.id_num for e in elements])
+        # Point where the optical axis goes through the plane of the segment.
+        self.p_opt_axis = self.center - self.d_center_optax[:, None] * self.e_z
+
+    def __call__(self, seg, dir, pol, interpos):
+        '''Calculate the new direction and polarization.
+
+        Parameters
+        ----------
+        seg : np.array of shape (N, )
+            Index number of the segment for each photon.
+        dir, pol, interpos : np.array of shape (N, 4)
+            Direction, polarization and intersection point of each photon in
+            homogeneous coordinates.
+
+        Returns
+        -------
+        dir, pol : np.array of shape (N, 4)
+            New direction and polarization.
+        '''
+        focuspoints = (self.p_opt_axis[seg] +
+                       self.focallength[seg][:, None] * norm_vector(h2e(dir)))
+        newdir = e2h(focuspoints - h2e(interpos), 0)
+        return newdir, parallel_transport(dir, newdir, pol)
+
+
 class SPOChannelMirror(Parallel):
     def __init__(self, **kwargs):
         kwargs['elem_pos'] = spo_pos4d
@@ -57,13 +135,155 @@ class SPOChannelMirror(Parallel):
         super(SPOChannelMirror, self).__init__(**kwargs)
 
 
-class SPOChannelasAperture(MultiAperture):
+class IndexedSPOChannelMirror(SPOChannelMirror):
+    '''SPO petal that finds the SPO for each photon with a spatial index.
+
+    `SPOChannelMirror` tests every photon against every SPO. All SPOs are
+    placed in the yz plane of the petal, so this class intersects the
+    photons with that plane once and then looks up the SPO in a
+    `arcus.spatialindex.RectangleIndex`. The output (including the ``spo``
+    column) is the same as for `SPOChannelMirror`, except for photons that
+    fall within rounding errors of the edge of an SPO.
+
+    The SPOs are applied to all photons in one pass with a
+    `PerfectLensSegmentKernel`, unless there are ``preprocess_steps`` or
+    ``postprocess_steps``, which need to run for every SPO separately.
+
+    If the SPOs are moved out of a common plane (e.g. by
+    ``elem_uncertainty``), the index cannot be used and photons are
+    processed by `SPOChannelMirror`.
+    '''
+    profile_children = False
+    '''SPOs are not called one by one, see `arcus.profiling`.'''
+
+    def generate_elements(self):
+        super(IndexedSPOChannelMirror, self).generate_elements()
+        self.index = self.build_index()
+        self.kernel = PerfectLensSegmentKernel(self.elements)
+
+    def build_index(self):
+        '''Set up a `arcus.spatialindex.RectangleIndex` for the SPOs.
+
+        Returns
+        -------
+        index : `arcus.spatialindex.RectangleIndex` or ``None``
+            ``None`` if the SPOs are not all in the yz plane of the petal.
+        '''
+        return footprint_index(self.pos4d, self.elements)
+
+    def __call__(self, photons):
+        if self.index is None:
+            return super(IndexedSPOChannelMirror, self).__call__(photons)
+        inv = np.linalg.inv(self.pos4d)
+        pos = np.dot(photons['pos'].data, inv.T)
+        dir = np.dot(photons['dir'].data, inv.T)
+        # Intersection with the x=0 plane in local coordinates.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interpos = pos - (pos[:, 0] / dir[:, 0])[:, None] * dir
+        spo, ind, coos = self.index.query_all(interpos[:, 1:3])
+        interpos = np.dot(interpos, self.pos4d.T)
+        if len(self.preprocess_steps + self.postprocess_steps) == 0:
+            return self.process_batched(photons, spo, ind, coos, interpos)
+        intercoos = np.empty((len(photons), 2))
+        # As in `SPOChannelMirror`, SPOs are processed in order. A photon in
+        # the area where two SPOs overlap is processed by both.
+        for i in np.unique(spo):
+            intersect = np.zeros(len(photons), dtype=bool)
+            intersect[ind[spo == i]] = True
+            intercoos[ind[spo == i], :] = coos[spo == i, :]
+            for p in self.preprocess_steps:
+                p(photons)
+            photons = self.elements[i].process_photons(photons, intersect,
+                                                       interpos, intercoos)
+            for p in self.postprocess_steps:
+                p(photons)
+        return photons
+
+    def process_batched(self, photons, spo, ind, coos, interpos):
+        '''Apply all SPOs to the photons in one pass.
+
+        Parameters
+        ----------
+        photons : `astropy.table.Table`
+        spo, ind, coos : np.array
+            SPO index number, photon index number and local coordinates as
+            returned by `arcus.spatialindex.RectangleIndex.query_all`.
+        interpos : np.array of shape (N, 4)
+            Intersection of the photons with the plane of the SPOs.
+        '''
+        if len(spo) == 0:
+            return photons
+        self.elements[0].add_output_cols(photons, self.elements[0].loc_coos_name)
+        xcol, ycol = self.elements[0].loc_coos_name
+        # ``query_all`` returns pairs sorted by photon, so a photon that
+        # falls into the overlap of two SPOs appears in consecutive pairs.
+        # Process the first SPO for every photon, then the second etc. to
+        # reproduce the order of `SPOChannelMirror`.
+        first = np.ones(len(ind), dtype=bool)
+        first[1:] = ind[1:] != ind[:-1]
+        n = np.arange(len(ind))
+        rank = n - np.maximum.accumulate(np.where(first, n, 0))
+        for r in range(rank.max() + 1):
+            s = spo[rank == r]
+            i = ind[rank == r]
+            dir, pol = self.kernel(s, photons['dir'].data[i, :],
+                                   photons['polarization'].data[i, :],
+                                   interpos[i, :])
+            photons[self.id_col][i] = self.kernel.id_num[s]
+            photons['pos'][i] = interpos[i, :]
+            photons[xcol][i] = coos[rank == r, 0]
+            photons[ycol][i] = coos[rank == r, 1]
+            photons['dir'][i] = dir
+            photons['polarization'][i] = pol
+        return photons
+
+
+class SPOChannelasAperture(SampledMultiAperture):
+    '''Aperture that covers only the SPOs of one petal.
+
+    Photons are placed on the footprints of the SPOs (in the same positions
+    as in `SPOChannelMirror`), so that no photon is generated on the frame
+    of the petal between the SPOs. As in `marxs.optics.MultiAperture`,
+    photons are distributed over the SPOs in proportion to their area and
+    `area` is the sum of the areas of all SPOs, so effective areas are
+    calculated the same way as for a rectangular aperture.
+
+    Where two SPO footprints overlap, photons are generated by both of
+    them. To keep the density of photons per area constant, the probability
+    of those photons is divided by the number of SPOs that cover their
+    position.
+
+    Parameters
+    ----------
+    pos4d, position, orientation, zoom
+        Position of the petal, as for `SPOChannelMirror`.
+    id_col : string or ``None``
+        Name of a column for the index number of the SPO footprint that
+        generated each photon. Default is ``None`` (no column), because the
+        SPO is recorded later by the mirror.
+    sampling : string
+        Sampling method for the SPOs and the positions within each SPO, see
+        `arcus.sampling`.
+    '''
     def __init__(self, **kwargs):
-        elements = [RectangleAperture(pos4d) for pos4d in spo_pos4d]
-        kwargs['elements'] = elements
+        kwargs.setdefault('id_col', None)
+        sampling = kwargs.setdefault('sampling', 'random')
+        self.pos4d = _parse_position_keywords(kwargs)
+        kwargs['elements'] = [SampledRectangleAperture(pos4d=np.dot(self.pos4d, p),
+                                                       sampling=sampling)
+                              for p in spo_pos4d]
         super(SPOChannelasAperture, self).__init__(**kwargs)
-        for e in self.elements:
-            e.pos4d = np.dot(self.pos4d, e.pos4d)
+        self.index = footprint_index(self.pos4d, self.elements)
+
+    def __call__(self, photons):
+        photons = super(SPOChannelasAperture, self).__call__(photons)
+        if self.index is not None:
+            pos = h2e(np.dot(photons['pos'].data, np.linalg.inv(self.pos4d).T))
+            spo, ind, coos = self.index.query_all(pos[:, 1:])
+            n_cover = np.bincount(ind, minlength=len(photons))
+            photons['probability'] /= np.maximum(n_cover, 1)
+        return photons
+
 
 spogeometricopening = load_number('spos', 'geometricthroughput',
                                   'transmission')
@@ -0,0 +1,148 @@
+'''Measure the time to import and set up ARCUS, split by phase.
+
+Short batch jobs spend a large fraction of their run time on setting up the
+instrument. `measure_startup` runs the setup step by step in a fresh
+process and reports the time spent in each phase:
+
+- ``third-party imports``: numpy, scipy, astropy, transforms3d and marxs,
+- ``arcus configuration``: ``import arcus``, which reads ``arcus.cfg``,
+- ``import arcus.arcus``: module level constants (e.g. the Rowland tori),
+- ``order selector splines``: the splines of `arcus.ralfgrating.InterpolateRalfTable`,
+- ``grating placement``: the grating grids (``gas4``),
+- ``detector placement``: the CCD arrays (``det_16`` and ``det``),
+- ``CircularDetector.from_rowland``: ``detcirc``, ``detcirc1`` and ``detcirc2``,
+- ``remaining elements``: everything else needed for the configuration.
+
+For each phase, the time spent reading tables from the caldb (see
+`arcus.load_csv.read_table`) is listed separately. It is taken from the
+events recorded by `arcus.timeline.timeline`.
+
+From the command line, run ``arcus_startup [configuration]`` (or
+``python -m arcus.startup [configuration]``).
+'''
+import os
+import sys
+import json
+import argparse
+import importlib
+import subprocess
+from timeit import default_timer
+from collections import OrderedDict
+
+phases = OrderedDict([
+    ('order selector splines', ['order_selector']),
+    ('grating placement', ['gas4']),
+    ('detector placement', ['det_16', 'det']),
+    ('CircularDetector.from_rowland', ['detcirc', 'detcirc1', 'detcirc2']),
+])
+'''Phases of the set-up after the import and the ARCUS elements built in them.'''
+
+
+def _third_party_imports():
+    import numpy
+    import scipy.interpolate
+    import astropy.table
+    import astropy.units
+    import astropy.coordinates
+    import transforms3d
+    import marxs.optics
+    import marxs.simulator
+    import marxs.design.rowland
+    import marxs.analysis
+
+
+def _measure(configuration):
+    '''Run all phases in this process.
+
+    This is only meaningful in a fresh process, where nothing has been
+    imported or built yet.
+    '''
+    result = OrderedDict()
+
+    def phase(name, func, timeline=None):
+        n_events = 0 if timeline is None else len(timeline.events)
+        start = default_timer()
+        func()
+        duration = default_timer() - start
+        caldb = [] if timeline is None else [e for e in timeline.events[n_events:]
+                                             if e.get('cat') == 'caldb']
+        result[name] = {'time': duration,
+                        'caldb_time': sum(e['dur'] for e in caldb) * 1e-6,
+                        'caldb_reads': len(caldb)}
+
+    phase('third-party imports', _third_party_imports)
+    # importlib, because "import arcus.arcus" in this package would be taken
+    # as a relative import.
+    phase('arcus configuration', lambda: importlib.import_module('arcus.timeline'))
+    timeline = importlib.import_module('arcus.timeline').timeline
+    timeline.start()
+    phase('import arcus.arcus', lambda: importlib.import_module('arcus.arcus'),
+          timeline)
+    arcus = importlib.import_module('arcus.arcus')
+
+    def build(names):
+        for name in names:
+            arcus.get(name)
+
+    for name, elements in phases.items():
+        phase(name, lambda: build(elements), timeline)
+    phase('remaining elements', lambda: arcus.get(configuration), timeline)
+    timeline.stop()
+    return result
+
+
+def measure_startup(configuration='arcus4'):
+    '''Measure the set-up of ARCUS in a fresh Python process.
+
+    Parameters
+    ----------
+    configuration : string
+        Name of the configuration to build, see `arcus.arcus.configurations`.
+
+    Returns
+    -------
+    tab : `astropy.table.Table`
+        Time (wall time in seconds) for each phase, the part of that time
+        spent reading the caldb and the number of caldb tables read.
+        The last row is the total.
+    '''
+    from astropy.table import Table
+    # Run this file as a script and not with "python -m arcus.startup",
+    # because that would import the arcus package before the measurement.
+    script = 'import runpy; runpy.run_path({!r}, run_name="__main__")'.format(
+        os.path.splitext(os.path.abspath(__file__))[0] + '.py')
+    out = subprocess.check_output([sys.executable, '-c', script,
+                                   '--json', configuration])
+    # Logging of the caldb goes to stderr, the last line of stdout is the
+    # result.
+    result = json.loads(out.decode('utf-8').strip().split('\n')[-1],
+                        object_pairs_hook=OrderedDict)
+    tab = Table(rows=[[k, v['time'], v['caldb_time'], v['caldb_reads']]
+                      for k, v in result.items()],
+                names=['phase', 'time', 'caldb_time', 'caldb_reads'],
+                dtype=[str, float, float, int])
+    tab.add_row(['total', tab['time'].sum(), tab['caldb_time'].sum(),
+                 tab['caldb_reads'].sum()])
+    tab['time'].unit = 's'
+    tab['caldb_time'].unit = 's'
+    tab['time'].format = '.3f'
+    tab['caldb_time'].format = '.3f'
+    return tab
+
+
+def main():
+    '''Command line interface for `measure_startup`.'''
+    parser = argparse.ArgumentParser(description='Measure the time needed to import and set up ARCUS, split by phase.')
+    parser.add_argument('configuration', nargs='?', default='arcus4',
+                        help='ARCUS configuration to build (default: arcus4)')
+    parser.add_argument('--json', action='store_true',
+                        help='Measure in this process and print the result as JSON.')
+    args = parser.parse_args()
+    if args.json:
+        print(json.dumps(_measure(args.configuration)))
+    else:
+        measure_startup(args.configuration).pprint(max_lines=-1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import pytest
+
+import arcus.arcus
+
+
+def test_elements_are_built_once():
+    '''Attribute access and `get` return the same, memoized object.'''
+    det = arcus.arcus.get('det_16')
+    assert arcus.arcus.det_16 is det
+    assert arcus.arcus.get('det_16') is det
+    assert 'det_16' in arcus.arcus.built()
+
+
+def test_unknown_element():
+    with pytest.raises(KeyError):
+        arcus.arcus.get('not_an_element')
+    with pytest.raises(AttributeError):
+        arcus.arcus.not_an_element
+
+
+def test_configurations_are_registered():
+    for conf in arcus.arcus.configurations:
+        assert conf in arcus.arcus.available()
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+
+from marxs.simulator import Sequence
+
+import arcus.arcus
+from arcus import conf, run
+from arcus.boom import (ThreeSidedBoom, BatchedThreeSidedBoom, BoomShadowMap,
+                        centerpos)
+
+mysource = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                       energy=0.5, flux=1.)
+mypointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def test_batched_boom_matches_rods():
+    '''Testing all rods at once gives the same result as one by one.'''
+    n = 5000
+    pos = np.zeros((n, 4))
+    pos[:, 0] = 12000.
+    pos[:, 1] = np.random.uniform(-1200, 1200, n) + centerpos[1]
+    pos[:, 2] = np.random.uniform(-1200, 1200, n)
+    pos[:, 3] = 1.
+    dir = np.zeros((n, 4))
+    dir[:, 0] = -1.
+    dir[:, 1:3] = np.random.normal(scale=0.03, size=(n, 2))
+    photons = Table({'pos': pos, 'dir': dir})
+    expected = ThreeSidedBoom(position=centerpos)(photons.copy())
+    boom = BatchedThreeSidedBoom(position=centerpos)
+    boom.chunksize = 1000
+    assert boom.in_bounding_cylinder(dir, pos).sum() < n
+    batched = boom(photons.copy())
+    assert expected['hitrod'].sum() > 100
+    assert np.all(expected['hitrod'] == batched['hitrod'])
+
+
+def test_shadow_map(tmpdir, monkeypatch):
+    '''Shadow map agrees with tracing through the boom behind the mirror.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    upstream = Sequence(elements=[arcus.arcus.aper, arcus.arcus.mirror])
+    photons = run.run_chunked(mysource, mypointing, upstream, 20000, 10000,
+                              run.CollectChunks(), seed=3).photons
+    # Rays converge towards the focal plane.
+    assert np.ptp(photons['dir'][:, 1] / photons['dir'][:, 0]) > 0.02
+    boom = BatchedThreeSidedBoom(position=centerpos)
+    expected = boom(photons.copy())
+
+    def shadowmap():
+        shadow = BoomShadowMap(boom, 12000., [-200, 200], [-850, 850])
+        shadow.rasterize(mysource, mypointing, upstream, 20000, 10000, seed=3)
+        return shadow
+
+    shadow = shadowmap()
+    assert len(os.listdir(str(tmpdir.join('boomshadow')))) == 1
+    looked_up = shadow(photons.copy())
+    # All photons of the rasterized beam are looked up.
+    assert shadow.n_traced == 0
+    live = photons['probability'] > 0
+    assert expected['hitrod'][live].sum() > 300
+    # Differences only for rays on the edge of a rod
+    diff = (expected['hitrod'] != looked_up['hitrod'])[live].sum()
+    assert diff < 0.02 * expected['hitrod'][live].sum()
+
+    # Second map is read from the cache and nothing is traced through the boom.
+    shadow2 = BoomShadowMap(boom, 12000., [-200, 200], [-850, 850])
+
+    def no_tracing(dir, pos):
+        assert len(dir) == 0
+        return np.zeros(0, dtype=bool)
+
+    shadow2.trace = no_tracing
+    shadow2.rasterize(mysource, mypointing, upstream, 20000, 10000, seed=3)
+    again = shadow2(photons.copy())
+    assert shadow2.n_traced == 0
+    assert np.all(again['hitrod'] == looked_up['hitrod'])
@@ -0,0 +1,86 @@
+import pytest
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+from marxs.simulator import Sequence
+from marxs.optics import RadialMirrorScatter
+
+import arcus.arcus
+from arcus import conf, checkpoint
+
+mysource = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                       energy=0.5, flux=1.)
+mypointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def trace(instrument, seed=0):
+    np.random.seed(seed)
+    photons = mypointing(mysource.generate_photons(1000))
+    return instrument(photons)
+
+
+def test_checkpoint_gives_same_result(tmpdir, monkeypatch):
+    '''Reusing saved photons gives the same result as tracing them.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    instrument = Sequence(elements=[arcus.arcus.aper, arcus.arcus.mirror,
+                                    arcus.arcus.gas, arcus.arcus.det_16])
+    expected = trace(instrument)
+    resumable = checkpoint.add_checkpoint(instrument, 'mirror')
+    first = trace(resumable)
+    second = trace(resumable)
+    assert resumable.checkpoint.misses == 1
+    assert resumable.checkpoint.hits == 1
+    for out in [first, second]:
+        for col in ['pos', 'dir', 'order', 'probability', 'CCD_ID']:
+            np.testing.assert_array_equal(out[col], expected[col])
+    assert second.colnames == first.colnames
+    for k in first.meta:
+        if k not in checkpoint._run_meta:
+            assert second.meta[k] == first.meta[k]
+    # A different seed gives different photons.
+    trace(resumable, seed=1)
+    assert resumable.checkpoint.misses == 2
+    # Later stages can change.
+    other = checkpoint.add_checkpoint(
+        Sequence(elements=[arcus.arcus.aper, arcus.arcus.mirror,
+                           arcus.arcus.gas]), arcus.arcus.mirror)
+    trace(other)
+    assert other.checkpoint.hits == 1
+    assert checkpoint.clear_checkpoints() == 2
+
+
+def test_key_depends_on_upstream():
+    def scatter(inplane):
+        return RadialMirrorScatter(inplanescatter=inplane, perpplanescatter=1e-5,
+                                   position=[12000, 0, 0], zoom=[1, 200, 820])
+    photons = mypointing(mysource.generate_photons(10))
+    keys = [checkpoint.Checkpoint([arcus.arcus.aper, scatter(s)]).key(photons)
+            for s in [1e-5, 1e-5, 2e-5]]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+
+def test_unknown_stage():
+    with pytest.raises(ValueError):
+        checkpoint.add_checkpoint(Sequence(elements=[arcus.arcus.aper]),
+                                  'mirror')
+
+
+def test_write_read_photons(tmpdir):
+    photons = mypointing(mysource.generate_photons(10))
+    photons['energy'].unit = u.keV
+    photons.meta['TEST'] = (np.int64(3), 'a numpy number')
+    state = np.random.get_state()
+    filename = str(tmpdir.join('photons.npz'))
+    checkpoint.write_photons(filename, photons, state)
+    out, outstate = checkpoint.read_photons(filename)
+    assert out.colnames == photons.colnames
+    for col in photons.colnames:
+        np.testing.assert_array_equal(out[col], photons[col])
+        assert out[col].dtype == photons[col].dtype
+    assert out['energy'].unit == u.keV
+    assert out.meta == photons.meta
+    assert outstate[0] == state[0]
+    np.testing.assert_array_equal(outstate[1], state[1])
+    assert outstate[2:] == state[2:]
@@ -0,0 +1,74 @@
+import pytest
+import numpy as np
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+from marxs.simulator import Sequence, KeepCol
+
+import arcus.arcus
+from arcus.compact import add_compaction
+
+
+src = PointSource(coords=SkyCoord(30., 30., unit='deg'), energy=0.5, flux=1.)
+pointing = FixedPointing(coords=SkyCoord(30., 30., unit='deg'))
+
+
+def test_compaction_keeps_results():
+    '''Removing dead photons does not change the detected photons.
+
+    No random numbers are drawn after the gratings, so the result is
+    identical if compaction happens only after that.
+    '''
+    compacted = add_compaction(arcus.arcus.arcus, ['gas'])
+    out = []
+    for instrument in [arcus.arcus.arcus, compacted]:
+        np.random.seed(0)
+        photons = instrument(pointing(src.generate_photons(2000)))
+        out.append(photons[photons['probability'] > 0])
+    assert len(out[0]) == len(out[1])
+    assert np.all(out[0]['probability'] == out[1]['probability'])
+    assert np.all(out[0]['CCD_ID'] == out[1]['CCD_ID'])
+
+
+def test_compaction_counters():
+    compacted = add_compaction(arcus.arcus.arcus, ['mirror', 'gas'])
+    assert len(compacted.compaction) == 2
+    # Input sequence is not changed
+    assert len(arcus.arcus.arcus.elements) == len(compacted.elements) - 2
+    photons = compacted(pointing(src.generate_photons(2000)))
+    n_removed = [c.n_removed for c in compacted.compaction]
+    assert n_removed[0] > 0
+    assert compacted.compaction[0].n_in == 2000
+    assert compacted.compaction[1].n_in == 2000 - n_removed[0]
+    assert photons.meta['COMPACT1'][0] == n_removed[0]
+    assert len(photons) == 2000 - sum(n_removed)
+
+
+def test_compaction_unknown_element():
+    with pytest.raises(ValueError):
+        add_compaction(arcus.arcus.arcus, [arcus.arcus.projectfp, 'det'])
+
+
+def test_compaction_with_keepcol():
+    '''KeepCol arrays keep the same length and match the live rows.'''
+    keeppos = arcus.arcus.keeppos4
+    compacted = add_compaction(arcus.arcus.arcus4, ['mirror4', 'gas4'])
+    keeppos.data = []
+    photons = compacted(pointing(src.generate_photons(2000)))
+    n_steps = len(compacted.elements)
+    assert np.vstack(keeppos.data).shape == (n_steps * len(photons), 4)
+
+    # No random numbers are drawn after the gratings, so the recorded
+    # positions of the detected photons are identical.
+    compacted = add_compaction(arcus.arcus.arcus4, ['gas4'])
+    out = []
+    for instrument in [arcus.arcus.arcus4, compacted]:
+        keeppos.data = []
+        np.random.seed(0)
+        photons = instrument(pointing(src.generate_photons(2000)))
+        pos = np.vstack(keeppos.data).reshape((-1, len(photons), 4))
+        out.append(pos[:, photons['probability'] > 0])
+    keeppos.data = []
+    # The Compact step after gas4 records one more array.
+    np.testing.assert_array_equal(out[1][:3], out[0][:3])
+    np.testing.assert_array_equal(out[1][3], out[0][2])
+    np.testing.assert_array_equal(out[1][4:], out[0][3:])
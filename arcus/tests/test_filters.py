@@ -0,0 +1,48 @@
+import numpy as np
+from astropy.table import Table
+from marxs.simulator import Sequence
+
+import arcus.arcus
+from arcus.filters import (fuse_energy_filters, find_energy_filters,
+                           CombinedEnergyFilter)
+
+
+def photonlist(energies):
+    return Table({'energy': energies, 'probability': np.ones_like(energies)})
+
+
+def test_combined_filter_matches_components():
+    '''The combined filter gives the product of the individual filters.'''
+    filters = find_energy_filters(Sequence(elements=[arcus.arcus.mirror,
+                                                     arcus.arcus.gas,
+                                                     arcus.arcus.filtersandqe]))
+    assert len(filters) == 8
+    combined = CombinedEnergyFilter(filters, keep_components=True)
+    energies = np.random.uniform(combined.energy_grid[0],
+                                 combined.energy_grid[-1], 1000)
+    expected = photonlist(energies)
+    for f in filters:
+        expected = f(expected)
+    photons = combined(photonlist(energies))
+    assert np.allclose(photons['probability'], expected['probability'],
+                       rtol=1e-3)
+    assert 'trans_qe' in photons.colnames
+    assert np.allclose(photons['trans_qe'], filters[-1].filterfunc(energies))
+
+
+def test_fuse_does_not_change_input():
+    instrument = arcus.arcus.arcus
+    n_before = len(find_energy_filters(instrument))
+    fused = fuse_energy_filters(instrument)
+    assert len(find_energy_filters(instrument)) == n_before
+    filters = find_energy_filters(fused)
+    assert len(filters) == 1
+    assert isinstance(filters[0], CombinedEnergyFilter)
+    assert len(filters[0].filters) == n_before
+    # Non-filter elements are shared, not copied.
+    assert fused.elements[0] is instrument.elements[0]
+
+
+def test_fuse_without_filters():
+    seq = Sequence(elements=[arcus.arcus.projectfp])
+    assert fuse_energy_filters(seq) is seq
@@ -0,0 +1,98 @@
+import os
+import numpy as np
+from astropy.table import Table
+
+from marxs.optics import FlatDetector
+from marxs.design.rowland import RowlandTorus, RectangularGrid
+
+from arcus import conf, layout
+
+
+def test_layout_is_reused(tmpdir, monkeypatch):
+    '''A cached layout gives the same positions as a calculated one.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    rowland = RowlandTorus(5000., 5000.)
+    args = {'rowland': rowland, 'd_element': 30., 'x_range': [5e3, 1e4],
+            'y_range': [-50, 50], 'z_range': [300, 400],
+            'elem_class': FlatDetector, 'elem_args': {'zoom': 10}}
+    grid = layout.CachedRectangularGrid(**args)
+    filename = grid.layout_cache_file()
+    assert os.path.exists(filename)
+    # Make sure that positions are taken from the file
+    pos = np.load(filename)
+    pos[0, 2, 3] = 1234.
+    np.save(filename, pos)
+    cached = layout.CachedRectangularGrid(**args)
+    assert cached.elements[0].pos4d[2, 3] == 1234.
+    expected = RectangularGrid(**args)
+    assert len(cached.elements) == len(expected.elements)
+    for c, e in zip(cached.elements[1:], expected.elements[1:]):
+        assert np.allclose(c.pos4d, e.pos4d)
+
+
+def test_layout_key_depends_on_torus(tmpdir, monkeypatch):
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    args = {'d_element': 30., 'x_range': [5e3, 1e4],
+            'y_range': [-50, 50], 'z_range': [300, 400],
+            'elem_class': FlatDetector, 'elem_args': {'zoom': 10}}
+    grid1 = layout.CachedRectangularGrid(rowland=RowlandTorus(5000., 5000.),
+                                         **args)
+    grid2 = layout.CachedRectangularGrid(rowland=RowlandTorus(5000., 5001.),
+                                         **args)
+    assert grid1.layout_cache_file() != grid2.layout_cache_file()
+
+
+def test_indexed_grid_matches_parallel(tmpdir, monkeypatch):
+    '''Gratings found with the index give the same result as testing all.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    import arcus.arcus
+    args = arcus.arcus.gratinggrid(arcus.arcus.rowland, arcus.arcus.blazemat,
+                                   np.array([0, 0., -5., 1.]))
+    args.update({'y_range': [-100, 100], 'z_range': [300, 500]})
+    n = 20000
+    pos = np.zeros((n, 4))
+    pos[:, 0] = 12000.
+    pos[:, 1] = np.random.uniform(-120, 120, n)
+    pos[:, 2] = np.random.uniform(280, 520, n)
+    pos[:, 3] = 1.
+    dir = -pos.copy()
+    dir[:, 3] = 0
+    pol = np.zeros((n, 4))
+    pol[:, 1] = 1.
+    photons = Table({'pos': pos, 'dir': dir, 'polarization': pol,
+                     'probability': np.ones(n),
+                     'energy': np.random.uniform(0.3, 0.9, n)})
+    out = []
+    for cls in [layout.CachedRectangularGrid, layout.IndexedRectangularGrid]:
+        np.random.seed(0)
+        out.append(cls(**args)(photons.copy()))
+    assert (out[0]['facet'] >= 0).sum() > 1000
+    for col in ['facet', 'order', 'dir', 'pos', 'probability']:
+        np.testing.assert_array_equal(out[0][col], out[1][col])
+
+
+def test_indexed_circle_array_matches_parallel(tmpdir, monkeypatch):
+    '''CCDs found from the angle give the same result as testing all.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    rowland = RowlandTorus(5000., 5000.)
+    # Arrays that cover theta = pi test the wrapping of the angles.
+    args = {'rowland': rowland, 'd_element': 30., 'theta': [2.9, 3.5],
+            'elem_class': FlatDetector, 'elem_args': {'zoom': [1, 14, 14]}}
+    n = 20000
+    pos = np.zeros((n, 4))
+    pos[:, 0] = 10000.
+    pos[:, 1] = np.random.uniform(-50, 50, n)
+    pos[:, 2] = np.random.uniform(-50, 50, n)
+    pos[:, 3] = 1.
+    dir = np.zeros((n, 4))
+    dir[:, 0] = -1.
+    dir[:, 1] = np.random.uniform(-0.4, 0.1, n)
+    dir[:, 2] = np.random.normal(scale=0.001, size=n)
+    photons = Table({'pos': pos, 'dir': dir, 'probability': np.ones(n)})
+    out = []
+    for cls in [layout.CachedRowlandCircleArray,
+                layout.IndexedRowlandCircleArray]:
+        out.append(cls(**args)(photons.copy()))
+    assert (out[0]['CCD_ID'] >= 0).sum() > 1000
+    for col in ['CCD_ID', 'pos', 'det_x']:
+        np.testing.assert_array_equal(out[0][col], out[1][col])
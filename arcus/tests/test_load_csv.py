@@ -0,0 +1,79 @@
+import numpy as np
+
+from arcus import conf, load_csv
+
+
+def test_caldb_file_is_parsed_once():
+    '''Repeated requests for the same file are served from the cache.'''
+    load_csv.clear_cache()
+    sigma = load_csv.load_number('gratings', 'debyewaller', 'sigma')
+    d = load_csv.load_number('gratings', 'debyewaller', 'd')
+    info = load_csv.cache_info()
+    assert info['misses'] == 1
+    assert info['hits'] == 1
+    assert info['size'] == 1
+    # Values do not change when read from the cache.
+    assert load_csv.load_number('gratings', 'debyewaller', 'sigma') == sigma
+    assert load_csv.load_number('gratings', 'debyewaller', 'd') == d
+
+
+def test_cache_is_bounded():
+    load_csv.clear_cache()
+    maxsize = load_csv.cache_maxsize
+    load_csv.cache_maxsize = 1
+    try:
+        load_csv.load_table('gratings', 'L1support')
+        load_csv.load_table('gratings', 'L2support')
+        load_csv.load_table('gratings', 'L1support')
+        info = load_csv.cache_info()
+        assert info['size'] == 1
+        assert info['misses'] == 3
+    finally:
+        load_csv.cache_maxsize = maxsize
+        load_csv.clear_cache()
+
+
+def test_load_table_returns_copy():
+    '''Changing a returned table must not change the cached version.'''
+    load_csv.clear_cache()
+    tab = load_csv.load_table('gratings', 'L1support')
+    tab['transmission'][0] = -1.
+    tab2 = load_csv.load_table('gratings', 'L1support')
+    assert tab2['transmission'][0] != -1.
+
+
+def test_compiled_caldb(tmpdir, monkeypatch):
+    '''Tables from the compiled caldb are the same as from the ecsv files.'''
+    monkeypatch.setattr(conf, 'cache_dir', str(tmpdir))
+    load_csv.clear_cache()
+    tab = load_csv.load_table('spos', 'reflectivity_simple')
+    try:
+        load_csv.compile_caldb()
+        load_csv.clear_cache()
+        tab2 = load_csv.load_table('spos', 'reflectivity_simple')
+        assert load_csv._compiled['index'] is not None
+        assert tab.colnames == tab2.colnames
+        for c in tab.colnames:
+            assert tab[c].unit == tab2[c].unit
+            assert np.all(tab[c] == tab2[c])
+        assert tab.meta == tab2.meta
+    finally:
+        load_csv.clear_cache()
+
+
+def test_git_runs_once(monkeypatch):
+    '''The version of the caldb is looked up only once per process.'''
+    calls = []
+    check_output = load_csv.subprocess.check_output
+
+    def counting_check_output(*args, **kwargs):
+        calls.append(args)
+        return check_output(*args, **kwargs)
+
+    load_csv.clear_cache()
+    monkeypatch.setattr(load_csv.subprocess, 'check_output',
+                        counting_check_output)
+    for i in range(3):
+        load_csv.get_git_hash()
+        load_csv.string_git_info()
+    assert len(calls) == 2
@@ -0,0 +1,52 @@
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+from marxs.simulator import Sequence
+
+import arcus.arcus
+from arcus import profiling
+
+mysource = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                       energy=0.5, flux=1.)
+mypointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def test_profile_arcus():
+    '''Profiling records every element and does not change the result.'''
+    instrument = Sequence(elements=[arcus.arcus.aper, arcus.arcus.mirror,
+                                    arcus.arcus.gas])
+    photons = mypointing(mysource.generate_photons(1000))
+    np.random.seed(0)
+    expected = instrument(photons.copy())
+    wrapped = profiling.profile_instrument(instrument, name='test')
+    np.random.seed(0)
+    out = wrapped(photons.copy())
+    for col in ['pos', 'dir', 'probability', 'order']:
+        np.testing.assert_array_equal(out[col], expected[col])
+
+    tab = out.meta['PROFILE']
+    assert tab['element'][0] == 'test'
+    names = list(tab['element'])
+    for name in ['test/aper', 'test/aper/aper_rect1', 'test/mirror/lens1',
+                 'test/mirror/spomounting', 'test/gas/gas_1']:
+        assert name in names
+    row = tab[names.index('test/mirror')]
+    assert row['calls'] == 1
+    assert row['n_in'] == 1000
+    assert row['n_live_out'] < row['n_live_in']
+    # The indexed containers are profiled as a whole.
+    assert not any(n.startswith('test/mirror/lens1/') for n in names)
+    # Times of nested elements are included in the container.
+    assert tab['time'][0] >= tab[names.index('test/mirror')]['time']
+    # Input instrument is unchanged.
+    assert instrument.elements[1] is arcus.arcus.mirror
+    assert not isinstance(arcus.arcus.mirror.elements[0],
+                          profiling.ProfiledElement)
+
+
+def test_duplicate_labels():
+    profile = profiling.Profile()
+    wrapped = profiling.profile_instrument(Sequence(elements=[np.copy, np.copy]),
+                                           profile=profile, name='s')
+    assert list(profile.table()['element']) == ['s', 's/copy[0]', 's/copy[1]']
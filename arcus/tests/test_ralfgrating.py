@@ -0,0 +1,49 @@
+import numpy as np
+
+from arcus.ralfgrating import InterpolateRalfTable
+
+
+def test_lookup_grid_matches_splines():
+    '''Probabilities from the lookup grid agree with the splines within the
+    accuracy estimated at construction.'''
+    spline = InterpolateRalfTable()
+    lookup = InterpolateRalfTable(lookup_shape=(400, 200))
+    assert lookup.lookup_accuracy < 1e-3
+    energies = np.random.uniform(0.25, 1., 1000)
+    blaze = np.random.uniform(0.02, 0.05, 1000)
+    orders, p_spline = spline.probabilities(energies, None, blaze)
+    orders2, p_lookup = lookup.probabilities(energies, None, blaze)
+    assert np.all(orders == orders2)
+    assert p_spline.shape == p_lookup.shape
+    assert np.allclose(p_lookup, p_spline, rtol=0, atol=2 * lookup.lookup_accuracy)
+
+
+def test_order_sampling_independent_of_blocksize():
+    '''Orders drawn in blocks are identical to drawing all at once.'''
+    selector = InterpolateRalfTable()
+    energies = np.random.uniform(0.25, 1., 1000)
+    blaze = np.random.uniform(0.02, 0.05, 1000)
+    pol = np.zeros(1000)
+    out = []
+    for blocksize in [10000, 300, 1]:
+        selector.blocksize = blocksize
+        np.random.seed(0)
+        out.append(selector(energies, pol, blaze))
+    for orders, totalprob in out[1:]:
+        assert np.all(orders == out[0][0])
+        assert np.all(totalprob == out[0][1])
+
+
+def test_selected_orders_unbiased():
+    '''With selected orders, the summed probability per order is unchanged.'''
+    energies = np.random.uniform(0.3, 0.8, 50000)
+    blaze = np.random.uniform(0.03, 0.04, 50000)
+    pol = np.zeros(50000)
+    selector = InterpolateRalfTable(selected_orders=[-4, -5, -6])
+    orders, p = selector.probabilities(energies.copy(), pol, blaze)
+    m, totalprob = selector(energies, pol, blaze)
+    assert set(m) <= set([-4, -5, -6])
+    assert np.allclose(totalprob, p[np.in1d(orders, [-4, -5, -6]), :].sum(axis=0))
+    for o in [-4, -5, -6]:
+        expected = p[orders == o, :].sum()
+        assert np.isclose(totalprob[m == o].sum(), expected, rtol=0.03)
@@ -0,0 +1,91 @@
+import pytest
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+from marxs.simulator import Sequence, KeepCol
+
+import arcus.arcus
+from arcus import run
+
+mysource = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                       energy=0.5, flux=1.)
+mypointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def test_chunks_cover_exposure():
+    intervals = run.chunk_intervals(1000, 300)
+    assert [i[0] for i in intervals] == [0, 300, 600, 900]
+    assert sum(i[1] for i in intervals) == 1000
+
+
+def test_run_chunked():
+    '''Photons from all chunks are collected with continuous times
+    and KeepCol data does not accumulate.'''
+    keeppos = KeepCol('pos')
+    instrument = Sequence(elements=[arcus.arcus.aper],
+                          postprocess_steps=[keeppos])
+    sink = run.run_chunked(mysource, mypointing, instrument, 1000, 300,
+                           run.CollectChunks(columns=['time', 'pos']))
+    assert len(sink.chunks) == 4
+    photons = sink.photons
+    assert photons.colnames == ['time', 'pos']
+    assert len(photons) == 1000
+    for i, chunk in enumerate(sink.chunks):
+        assert np.all(chunk['time'] >= 300 * i)
+        assert np.all(chunk['time'] < 300 * (i + 1))
+    assert keeppos.data == []
+
+
+def test_parallel_is_reproducible():
+    '''Results depend on the seed, but not on the number of processes.'''
+    instrument = Sequence(elements=[arcus.arcus.aper, arcus.arcus.rms])
+    out = []
+    for processes in [None, 1, 3]:
+        sink = run.CollectChunks(columns=['time', 'pos', 'dir'])
+        if processes is None:
+            run.run_chunked(mysource, mypointing, instrument, 1000, 300,
+                            sink, seed=5)
+        else:
+            run.run_parallel(mysource, mypointing, instrument, 1000, 300,
+                             sink, seed=5, processes=processes)
+        out.append(sink.photons)
+    for photons in out[1:]:
+        for col in ['time', 'pos', 'dir']:
+            assert np.all(photons[col] == out[0][col])
+
+
+def test_parallel_without_seed():
+    '''Without a seed, chunks traced in different workers still differ.'''
+    instrument = Sequence(elements=[arcus.arcus.aper, arcus.arcus.rms])
+    sink = run.CollectChunks(columns=['pos', 'dir'])
+    run.run_parallel(mysource, mypointing, instrument, 600, 300, sink,
+                     seed=None, processes=2)
+    assert len(sink.chunks) == 2
+    assert np.all(sink.chunks[0]['pos'][:, 1:3] != sink.chunks[1]['pos'][:, 1:3])
+
+
+class CountCalls(object):
+    '''Identity element that counts its calls in a file.'''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, photons):
+        with open(self.filename, 'a') as f:
+            f.write('x')
+        return photons
+
+
+def failing_sink(photons):
+    raise ValueError('sink failed')
+
+
+def test_parallel_stops_on_error(tmpdir):
+    '''An error in the sink stops the run without tracing all chunks.'''
+    filename = str(tmpdir.join('calls'))
+    with pytest.raises(ValueError):
+        run.run_parallel(mysource, mypointing, CountCalls(filename), 1000, 10,
+                         failing_sink, seed=1, processes=2, max_pending=2)
+    with open(filename) as f:
+        n_traced = len(f.read())
+    assert n_traced < 20
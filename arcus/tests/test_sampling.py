@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+from astropy.table import Table
+
+from arcus import sampling
+from arcus.spo import SPOChannelasAperture
+
+
+def aperture_photons(n):
+    dir = np.zeros((n, 4))
+    dir[:, 0] = -1.
+    return Table({'dir': dir, 'probability': np.ones(n)})
+
+
+def test_sobol():
+    '''Without scrambling, the first points are the textbook values.'''
+    points = sampling.sobol(4, scramble=False)
+    assert np.all(points == [[0, 0], [.5, .5], [.75, .25], [.25, .75]])
+    points = sampling.sobol(1024)
+    assert np.all((points >= 0) & (points < 1))
+    # Each of the 1024 squares of size 1/32 * 1/32 contains one point.
+    cells = np.floor(points * 32).astype(int)
+    assert len(np.unique(cells[:, 0] * 32 + cells[:, 1])) == 1024
+
+
+def test_stratified():
+    x = np.sort(sampling.stratified(100))
+    assert np.all(np.floor(x * 100) == np.arange(100))
+
+
+@pytest.mark.parametrize('method', sampling.methods)
+def test_aperture_positions(method):
+    aper = sampling.SampledRectangleAperture(zoom=[1, 2, 3], sampling=method)
+    photons = aper(aperture_photons(1000))
+    assert np.all(np.abs(photons['pos'][:, 1]) <= 2)
+    assert np.all(np.abs(photons['pos'][:, 2]) <= 3)
+    assert np.all(photons['probability'] == 1)
+
+
+def test_random_is_unchanged():
+    '''The default gives the same photons as the marxs apertures.'''
+    from marxs.optics import RectangleAperture, MultiAperture
+    out = []
+    for rect, multi in [(RectangleAperture, MultiAperture),
+                        (sampling.SampledRectangleAperture,
+                         sampling.SampledMultiAperture)]:
+        np.random.seed(0)
+        aper = multi(elements=[rect(position=[0, 0, 5]),
+                               rect(position=[0, 0, -5], zoom=2)])
+        out.append(aper(aperture_photons(1000)))
+    for col in ['pos', 'aperture']:
+        assert np.all(out[0][col] == out[1][col])
+
+
+@pytest.mark.parametrize('method', ['stratified', 'sobol'])
+def test_spos_get_expected_number(method):
+    '''Each SPO receives its expected number of photons (rounded).'''
+    aper = SPOChannelasAperture(sampling=method, id_col='spo_aper')
+    n = 100000
+    photons = aper(aperture_photons(n))
+    areas = np.array([e.area.value for e in aper.elements])
+    expected = n * areas / areas.sum()
+    counts = np.bincount(photons['spo_aper'], minlength=len(areas))
+    assert np.all(np.abs(counts - expected) <= 1)
+
+
+def test_set_sampling():
+    aper = SPOChannelasAperture()
+    multi = sampling.SampledMultiAperture(elements=[aper])
+    sampling.set_sampling(multi, 'sobol')
+    assert multi.sampling == 'sobol'
+    assert aper.sampling == 'sobol'
+    assert all(e.sampling == 'sobol' for e in aper.elements)
+    with pytest.raises(ValueError):
+        sampling.set_sampling(multi, 'grid')
@@ -0,0 +1,29 @@
+import numpy as np
+
+from arcus.spatialindex import RectangleIndex
+
+
+def test_query_matches_brute_force():
+    '''Index gives the same result as testing every rectangle.'''
+    n = 50
+    center = np.random.uniform(-100, 100, (n, 2))
+    ang = np.random.uniform(0, np.pi, n)
+    e_y = np.vstack([np.cos(ang), np.sin(ang)]).T
+    e_z = np.vstack([-np.sin(ang), np.cos(ang)]).T
+    half_y = np.random.uniform(1, 10, n)
+    half_z = np.random.uniform(1, 10, n)
+    index = RectangleIndex(center, e_y, e_z, half_y, half_z)
+    points = np.random.uniform(-120, 120, (10000, 2))
+    points[0, :] = np.nan
+
+    expected = -np.ones(len(points), dtype=int)
+    for i in range(n)[::-1]:
+        d = points - center[i]
+        ey = np.sum(d * e_y[i], axis=1)
+        ez = np.sum(d * e_z[i], axis=1)
+        expected[(np.abs(ey) <= half_y[i]) & (np.abs(ez) <= half_z[i])] = i
+
+    ind, coos = index.query(points)
+    assert np.all(ind == expected)
+    assert np.all(np.isnan(coos[ind < 0]))
+    assert np.all(np.abs(coos[ind >= 0, 0]) <= half_y[ind[ind >= 0]])
@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from astropy.table import Table
+from marxs.simulator import KeepCol
+from marxs.math.utils import h2e
+
+from arcus.spo import (SPOChannelMirror, IndexedSPOChannelMirror,
+                       SPOChannelasAperture, spogeom)
+
+
+def spo_photons():
+    n = 10000
+    pos = np.zeros((n, 4))
+    pos[:, 0] = 13000.
+    pos[:, 1] = np.random.uniform(-800, 800, n)
+    pos[:, 2] = np.random.uniform(-800, 800, n)
+    pos[:, 3] = 1.
+    dir = np.zeros((n, 4))
+    dir[:, 0] = -1.
+    dir[:, 1:3] = np.random.normal(scale=1e-4, size=(n, 2))
+    pol = np.zeros((n, 4))
+    pol[:, 1] = 1.
+    photons = Table({'pos': pos, 'dir': dir, 'polarization': pol,
+                     'probability': np.ones(n), 'energy': np.ones(n)})
+    return photons
+
+
+@pytest.mark.parametrize('steps', [[], [KeepCol('spo')]])
+def test_indexed_mirror_matches_parallel(steps):
+    '''Looking up SPOs in the index gives the same result as testing all.
+
+    Without postprocess_steps, all SPOs are processed in one batch.
+    '''
+    photons = spo_photons()
+    kwargs = {'position': [12000., 10., -5.], 'id_num_offset': 1000,
+              'orientation': np.array([[1., 0, 0], [0, -1, 0], [0, 0, -1]])}
+    p1 = SPOChannelMirror(**kwargs)(photons.copy())
+    p2 = IndexedSPOChannelMirror(postprocess_steps=steps, **kwargs)(photons.copy())
+    assert (p1['spo'] >= 0).sum() > 300
+    assert np.all(p1['spo'] == p2['spo'])
+    assert np.allclose(h2e(p1['pos']), h2e(p2['pos']))
+    for col in ['dir', 'polarization', 'mirror_x', 'mirror_y']:
+        assert np.allclose(p1[col], p2[col], equal_nan=True)
+
+
+def test_spo_aperture():
+    '''All photons from the SPO aperture go through an SPO.'''
+    kwargs = {'position': [12000., 10., -5.],
+              'orientation': np.array([[1., 0, 0], [0, -1, 0], [0, 0, -1]])}
+    aper = SPOChannelasAperture(**kwargs)
+    assert np.isclose(aper.area.value,
+                      np.sum(spogeom['width'] * spogeom['depth']))
+    photons = spo_photons()
+    photons.remove_column('pos')
+    photons = aper(photons)
+    p = IndexedSPOChannelMirror(**kwargs)(photons)
+    assert np.all(p['spo'] >= 0)
+    # Photons where two SPO footprints overlap are generated by both SPOs.
+    pos = h2e(np.dot(p['pos'].data, np.linalg.inv(aper.pos4d).T))
+    spo, ind, coos = aper.index.query_all(pos[:, 1:])
+    n_cover = np.bincount(ind, minlength=len(p))
+    assert np.allclose(p['probability'] * n_cover, 1.)
@@ -0,0 +1,15 @@
+import numpy as np
+
+from arcus.startup import measure_startup, phases
+
+
+def test_startup_phases():
+    tab = measure_startup('arcus')
+    names = list(tab['phase'])
+    for p in phases:
+        assert p in names
+    assert names[-1] == 'total'
+    assert np.isclose(tab['time'][-1], tab['time'][:-1].sum())
+    assert np.all(tab['caldb_time'] <= tab['time'])
+    # The SPO geometry is read from the caldb when arcus.arcus is imported.
+    assert tab['caldb_reads'][names.index('import arcus.arcus')] > 0
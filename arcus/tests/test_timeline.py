@@ -0,0 +1,72 @@
+import json
+
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from marxs.source import PointSource, FixedPointing
+
+from arcus import run, load_csv
+from arcus.timeline import Timeline, timeline
+
+mysource = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                       energy=0.5, flux=1.)
+mypointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def test_only_record_when_started():
+    t = Timeline()
+    with t.span('a', 'test'):
+        pass
+    assert t.events == []
+    t.start()
+    with t.span('a', 'test', x=1) as args:
+        args['y'] = 2
+    t.stop()
+    t.add('b', 'test', 0, 1)
+    assert len(t.events) == 1
+    assert t.events[0]['args'] == {'x': 1, 'y': 2}
+    assert t.events[0]['ph'] == 'X'
+
+
+def test_parallel_run_timeline(tmpdir):
+    '''Chunks, elements and caldb reads from workers end up in the timeline.'''
+    load_csv.clear_cache()
+    timeline.clear()
+    timeline.start()
+    try:
+        run.run_parallel(mysource, mypointing, 'arcus', 600, 300,
+                         run.CollectChunks(columns=['time']), seed=1,
+                         processes=2)
+    finally:
+        timeline.stop()
+    events = timeline.pop_events()
+    filename = str(tmpdir.join('trace.json'))
+    t = Timeline()
+    t.events = events
+    t.write(filename)
+    with open(filename) as f:
+        trace = json.load(f)['traceEvents']
+    cats = set(e.get('cat') for e in trace)
+    for cat in ['chunk', 'element', 'caldb', 'provenance', 'sink', 'run']:
+        assert cat in cats
+    names = [e['name'] for e in trace if e.get('cat') == 'chunk']
+    assert sorted(names) == ['chunk 0', 'chunk 1']
+    # Chunks are traced in worker processes, the sink runs in this one.
+    sinkpid = set(e['pid'] for e in trace if e.get('cat') == 'sink')
+    chunkpid = set(e['pid'] for e in trace if e.get('cat') == 'chunk')
+    assert sinkpid.isdisjoint(chunkpid)
+    assert 'arcus/mirror' in [e['name'] for e in trace]
+
+
+def test_parallel_run_events_not_duplicated():
+    '''Events from before the run are not sent back by the workers.'''
+    timeline.clear()
+    timeline.start()
+    try:
+        timeline.add('before run', 'test', 0, 1)
+        run.run_parallel(mysource, mypointing, 'arcus', 600, 300,
+                         run.CollectChunks(columns=['time']), seed=1,
+                         processes=2)
+    finally:
+        timeline.stop()
+    names = [e['name'] for e in timeline.pop_events()]
+    assert names.count('before run') == 1
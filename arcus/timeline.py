@@ -0,0 +1,119 @@
+'''Record a timeline of a simulation run in the Chrome trace event format.
+
+While `timeline` is recording, the following steps add events to it:
+
+- every call of an element wrapped with `arcus.profiling.profile_instrument`,
+- every chunk of photons and every call of the sink in `arcus.run`,
+  including the chunks traced in worker processes by `arcus.run.run_parallel`,
+- every table read from the caldb with `arcus.load_csv.read_table`,
+- every call of `arcus.utils.TagVersion`.
+
+Each event records the process and thread that it ran in, so that the
+work done by different worker processes shows up on separate rows when the
+file written by `Timeline.write` is opened in a viewer for Chrome traces
+(e.g. ``chrome://tracing`` or https://ui.perfetto.dev)::
+
+    from arcus.timeline import timeline
+    timeline.start()
+    run.run_parallel(source, pointing, 'arcus_extra_det4', 1e5, 1e4, sink,
+                     seed=1)
+    timeline.stop()
+    timeline.write('run.json')
+
+When the timeline is not recording, no events are stored and the overhead
+is negligible compared to the time to trace photons.
+'''
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Timeline(object):
+    '''Collect events in the Chrome trace event format.
+
+    Attributes
+    ----------
+    events : list of dict
+        Recorded events. Times are in microseconds since the epoch.
+    recording : bool
+        Events are only recorded if this is ``True``.
+    '''
+    def __init__(self):
+        self.events = []
+        self.recording = False
+
+    def start(self):
+        '''Start recording events.'''
+        self.recording = True
+
+    def stop(self):
+        '''Stop recording events. Events recorded so far are kept.'''
+        self.recording = False
+
+    def clear(self):
+        '''Remove all recorded events.'''
+        self.events = []
+
+    def add(self, name, cat, start, duration, **args):
+        '''Add an event that has already finished.
+
+        Parameters
+        ----------
+        name : string
+            Name of the event, e.g. the name of an element.
+        cat : string
+            Category of the event, e.g. ``'element'`` or ``'caldb'``.
+        start, duration : float
+            Start time (as returned by ``time.time()``) and duration in
+            seconds.
+        args : dict
+            Additional information that is shown with the event.
+        '''
+        if not self.recording:
+            return
+        self.events.append({'name': name, 'cat': cat, 'ph': 'X',
+                            'ts': start * 1e6, 'dur': duration * 1e6,
+                            'pid': os.getpid(),
+                            'tid': threading.current_thread().ident,
+                            'args': args})
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        '''Context manager that adds an event for the code it contains.
+
+        ``args`` can be changed or extended inside of the ``with`` block.
+        '''
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, cat, start, time.time() - start, **args)
+
+    def label_process(self, name):
+        '''Set the name that viewers show for the current process.'''
+        if self.recording:
+            self.events.append({'name': 'process_name', 'ph': 'M',
+                                'pid': os.getpid(), 'args': {'name': name}})
+
+    def pop_events(self):
+        '''Return and remove all recorded events.'''
+        events = self.events
+        self.events = []
+        return events
+
+    def write(self, filename):
+        '''Write all events to a JSON file in the Chrome trace event format.
+
+        Parameters
+        ----------
+        filename : string
+        '''
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, f)
+
+
+timeline = Timeline()
+'''Timeline for the current process.'''
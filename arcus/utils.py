@@ -1,15 +1,23 @@
 from marxs.base import MarxsElement
 from . import version
 from load_csv import get_git_hash, string_git_info
+from .timeline import timeline
 
 
 class TagVersion(MarxsElement):
+    '''Add version information for code and input data to the photon meta.
+
+    The version of the caldb-inputdata repository is determined only once per
+    process (see `arcus.load_csv.get_git_hash`), so this element is cheap
+    enough to run on every chunk of photons.
+    '''
     def __call__(self, photons, *args, **kwargs):
-        photons.meta['ARCUSVER'] = (version.version, 'ARCUS code version')
-        photons.meta['ARCUSGIT'] = (version.githash, 'Git hash of ARCUS code')
-        photons.meta['ARCUSTIM'] = (version.timestamp, 'Commit time')
-        photons.meta['ARCDATHA'] = (get_git_hash()[:10], 'Git hash of simulation input data')
-        photons.meta['ARCDATGI'] = (string_git_info()[:20], '')
+        with timeline.span('TagVersion', 'provenance'):
+            photons.meta['ARCUSVER'] = (version.version, 'ARCUS code version')
+            photons.meta['ARCUSGIT'] = (version.githash, 'Git hash of ARCUS code')
+            photons.meta['ARCUSTIM'] = (version.timestamp, 'Commit time')
+            photons.meta['ARCDATHA'] = (get_git_hash()[:10], 'Git hash of simulation input data')
+            photons.meta['ARCDATGI'] = (string_git_info()[:20], '')
         return photons
 
 tagversion = TagVersion()
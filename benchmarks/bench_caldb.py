@@ -0,0 +1,58 @@
+'''Speed of reading tables from the caldb.'''
+import shutil
+import tempfile
+
+from arcus import conf, load_csv
+
+tables = [('spos', 'petallayout'), ('gratings', 'efficiency')]
+
+
+class Loaders(object):
+    '''Read a table with an empty in-process cache.
+
+    ``source`` selects whether the table is parsed from the ecsv file or
+    taken from the compiled caldb (see `arcus.load_csv.compile_caldb`).
+    ``conf.cache_dir`` points to a temporary directory during the benchmark,
+    so the compiled caldb of the user is neither used nor changed.
+    '''
+    params = (['ecsv', 'compiled'], ['load_table', 'load_table2d'])
+    param_names = ['source', 'loader']
+    number = 1
+    repeat = 10
+
+    def setup(self, source, loader):
+        self.cache_dir = conf.cache_dir
+        conf.cache_dir = tempfile.mkdtemp()
+        if source == 'compiled':
+            load_csv.compile_caldb()
+        load_csv.clear_cache()
+
+    def teardown(self, source, loader):
+        shutil.rmtree(conf.cache_dir)
+        conf.cache_dir = self.cache_dir
+        load_csv.clear_cache()
+
+    def time_load(self, source, loader):
+        if loader == 'load_table':
+            load_csv.load_table(*tables[0])
+        else:
+            load_csv.load_table2d(*tables[1])
+
+
+class CachedLoaders(object):
+    '''Read a table that is already in the in-process cache.'''
+    params = ['load_number', 'load_table', 'load_table2d']
+    param_names = ['loader']
+
+    def setup(self, loader):
+        load_csv.load_table2d(*tables[1])
+        load_csv.load_table(*tables[0])
+        load_csv.load_number('spos', 'geometricthroughput', 'transmission')
+
+    def time_load(self, loader):
+        if loader == 'load_number':
+            load_csv.load_number('spos', 'geometricthroughput', 'transmission')
+        elif loader == 'load_table':
+            load_csv.load_table(*tables[0])
+        else:
+            load_csv.load_table2d(*tables[1])
@@ -0,0 +1,61 @@
+'''Speed and memory of complete ARCUS configurations.'''
+from timeit import default_timer
+
+import arcus.arcus
+from arcus.boom import ThreeSidedBoom, BatchedThreeSidedBoom, centerpos
+
+from .common import source_photons, parallel_photons
+
+
+class Configurations(object):
+    '''Trace photons from an on-axis source through a configuration.
+
+    Elements are built in ``setup``, so only the ray-trace is measured.
+    '''
+    params = (['arcus', 'arcusm', 'arcus4', 'arcus_extra_det', 'arcus_joern'],
+              [1000, 10000])
+    param_names = ['configuration', 'n_photons']
+    timeout = 600
+
+    def setup(self, configuration, n):
+        self.instrument = arcus.arcus.get(configuration)
+        self.photons = source_photons(n)
+
+    def time_trace(self, configuration, n):
+        self.instrument(self.photons.copy())
+
+    def peakmem_trace(self, configuration, n):
+        self.instrument(self.photons.copy())
+
+    def track_photons_per_second(self, configuration, n):
+        start = default_timer()
+        self.instrument(self.photons.copy())
+        return n / (default_timer() - start)
+    track_photons_per_second.unit = 'photons/s'
+
+
+class Boom(object):
+    '''Trace photons through the boom, testing rods one by one or all at once.'''
+    params = (['ThreeSidedBoom', 'BatchedThreeSidedBoom'], [1000, 10000])
+    param_names = ['boom', 'n_photons']
+    timeout = 600
+
+    def setup(self, boom, n):
+        cls = {'ThreeSidedBoom': ThreeSidedBoom,
+               'BatchedThreeSidedBoom': BatchedThreeSidedBoom}[boom]
+        self.boom = cls(position=centerpos)
+        self.photons = parallel_photons(n, 12000., [-1200 + centerpos[1],
+                                                    1200 + centerpos[1]],
+                                        [-1200, 1200], sigma=0.03)
+
+    def time_trace(self, boom, n):
+        self.boom(self.photons.copy())
+
+    def peakmem_trace(self, boom, n):
+        self.boom(self.photons.copy())
+
+    def track_photons_per_second(self, boom, n):
+        start = default_timer()
+        self.boom(self.photons.copy())
+        return n / (default_timer() - start)
+    track_photons_per_second.unit = 'photons/s'
@@ -0,0 +1,82 @@
+'''Speed of individual elements at several photon counts.'''
+import numpy as np
+
+from arcus.ralfgrating import InterpolateRalfTable
+from arcus.spo import PerfectLensSegment, SPOChannelMirror, IndexedSPOChannelMirror
+from arcus.boom import Rod
+
+from .common import parallel_photons
+
+n_photons = [1000, 10000, 100000]
+
+
+class OrderSelection(object):
+    '''Draw grating orders with the splines or the lookup grid.'''
+    params = ([None, (400, 200)], n_photons)
+    param_names = ['lookup_shape', 'n_photons']
+
+    def setup(self, lookup_shape, n):
+        self.selector = InterpolateRalfTable(lookup_shape=lookup_shape)
+        np.random.seed(0)
+        self.energies = np.random.uniform(0.25, 1., n)
+        self.blaze = np.random.uniform(0.02, 0.05, n)
+        self.pol = np.zeros(n)
+
+    def time_call(self, lookup_shape, n):
+        self.selector(self.energies, self.pol, self.blaze)
+
+
+class LensSegment(object):
+    '''Focus photons with a single SPO.'''
+    params = n_photons
+    param_names = ['n_photons']
+
+    def setup(self, n):
+        self.segment = PerfectLensSegment(d_center_optical_axis=500.,
+                                          focallength=12000.,
+                                          position=[0, 0, 500],
+                                          zoom=[1, 50, 50])
+        self.photons = parallel_photons(n, 100., [-50, 50], [450, 550])
+        self.intersect, self.interpos, self.intercoos = \
+            self.segment.intersect(self.photons['dir'].data,
+                                   self.photons['pos'].data)
+
+    def time_intersect(self, n):
+        self.segment.intersect(self.photons['dir'].data,
+                               self.photons['pos'].data)
+
+    def time_process_photons(self, n):
+        self.segment.process_photons(self.photons.copy(), self.intersect,
+                                     self.interpos, self.intercoos)
+
+
+class SPOPetal(object):
+    '''Focus photons with all SPOs of one petal.'''
+    params = (['SPOChannelMirror', 'IndexedSPOChannelMirror'], [1000, 10000])
+    param_names = ['mirror', 'n_photons']
+    timeout = 300
+
+    def setup(self, mirror, n):
+        cls = {'SPOChannelMirror': SPOChannelMirror,
+               'IndexedSPOChannelMirror': IndexedSPOChannelMirror}[mirror]
+        self.mirror = cls(position=[12000., 0., 0.])
+        self.photons = parallel_photons(n, 12100., [-400, 400], [200, 900])
+
+    def time_call(self, mirror, n):
+        self.mirror(self.photons.copy())
+
+
+class RodIntersect(object):
+    '''Intersect photons with a single rod of the boom.'''
+    params = n_photons
+    param_names = ['n_photons']
+
+    def setup(self, n):
+        self.rod = Rod(orientation=np.array([[0., 0, 1], [0, 1, 0], [-1, 0, 0]]),
+                       zoom=[500, 10, 10])
+        photons = parallel_photons(n, 100., [-20, 20], [-600, 600], sigma=0.1)
+        self.dir = photons['dir'].data
+        self.pos = photons['pos'].data
+
+    def time_intersect(self, n):
+        self.rod.intersect(self.dir, self.pos)
@@ -0,0 +1,24 @@
+'''Time to import and set up ARCUS in a fresh process.'''
+from arcus.startup import measure_startup
+
+
+class Startup(object):
+    '''Set-up time for ``arcus4``, split by phase (see `arcus.startup`).'''
+    params = ['third-party imports', 'arcus configuration',
+              'import arcus.arcus', 'order selector splines',
+              'grating placement', 'detector placement',
+              'CircularDetector.from_rowland', 'remaining elements', 'total']
+    param_names = ['phase']
+    timeout = 300
+
+    def setup_cache(self):
+        tab = measure_startup('arcus4')
+        return dict(zip(tab['phase'], zip(tab['time'], tab['caldb_time'])))
+
+    def track_time(self, result, phase):
+        return result[phase][0]
+    track_time.unit = 's'
+
+    def track_caldb_time(self, result, phase):
+        return result[phase][1]
+    track_caldb_time.unit = 's'
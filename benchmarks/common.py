@@ -0,0 +1,45 @@
+'''Photon lists shared by several benchmarks.'''
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+from marxs.source import PointSource, FixedPointing
+
+source = PointSource(coords=SkyCoord(30. * u.deg, 30. * u.deg),
+                     energy=0.5, flux=1.)
+pointing = FixedPointing(coords=SkyCoord(30 * u.deg, 30. * u.deg))
+
+
+def source_photons(n):
+    '''Photons from an on-axis point source, ready for the aperture.'''
+    np.random.seed(0)
+    return pointing(source.generate_photons(n))
+
+
+def parallel_photons(n, x, y_range, z_range, sigma=1e-4):
+    '''Photons that travel roughly along -x, starting in a rectangle.
+
+    Parameters
+    ----------
+    n : int
+        Number of photons.
+    x : float
+        x position where all photons start.
+    y_range, z_range : list of two floats
+        Range of the start positions in y and z.
+    sigma : float
+        Scatter of the photon directions in radian.
+    '''
+    np.random.seed(0)
+    pos = np.zeros((n, 4))
+    pos[:, 0] = x
+    pos[:, 1] = np.random.uniform(y_range[0], y_range[1], n)
+    pos[:, 2] = np.random.uniform(z_range[0], z_range[1], n)
+    pos[:, 3] = 1.
+    dir = np.zeros((n, 4))
+    dir[:, 0] = -1.
+    dir[:, 1:3] = np.random.normal(scale=sigma, size=(n, 2))
+    pol = np.zeros((n, 4))
+    pol[:, 1] = 1.
+    return Table({'pos': pos, 'dir': dir, 'polarization': pol,
+                  'probability': np.ones(n), 'energy': np.ones(n) * 0.5})